@@ -1,9 +1,91 @@
-import requests
+import json
+import time
 
 from utils.agent.RAG import RAG
-from utils.agent.ollama_client import safe_post, CHAT_URL
+from utils.agent.ollama_client import safe_post, get_client, CHAT_URL
+from utils.agent.llm_scheduler import scheduler
+from utils.agent.prompt_builder import PromptBuilder
+from utils.metrics import metrics, stage, current_trace
+
+
+def record_ollama_stats(model, stats):
+    """Token counts and timings Ollama reports in its final response"""
+    if stats.get("prompt_eval_count") is not None:
+        metrics.inc("ollama_prompt_tokens_total", stats["prompt_eval_count"], model=model)
+    if stats.get("eval_count") is not None:
+        metrics.inc("ollama_generated_tokens_total", stats["eval_count"], model=model)
+    # Durations are reported in nanoseconds
+    if stats.get("prompt_eval_duration") is not None:
+        metrics.observe("ollama_prompt_eval_seconds", stats["prompt_eval_duration"] / 1e9, model=model)
+    if stats.get("eval_duration") is not None:
+        metrics.observe("ollama_eval_seconds", stats["eval_duration"] / 1e9, model=model)
+    if stats.get("ttft") is not None:
+        metrics.observe("ollama_ttft_seconds", stats["ttft"], model=model)
+
+    trace = current_trace()
+    if trace is not None:
+        trace.set(**{
+            key: stats[key]
+            for key in ("prompt_eval_count", "eval_count", "ttft", "truncated")
+            if stats.get(key) is not None
+        })
+
+def ollama_chat(
+    prompt,
+    model="llama3",
+    stream=False,
+    max_tokens=None,
+    max_latency=None,
+    on_first_paragraph=None,
+    stats=None,
+    cancel=None,
+    priority="chat",
+    user_id=None,
+):
+    """
+    Args:
+        prompt: User prompt
+        model: LLM model to use
+        stream: Consume the response incrementally (see ollama_chat_stream)
+        max_tokens, max_latency, stats, cancel: Passed to ollama_chat_stream
+            (with cancel, the response is streamed even if stream=False so a
+            cancelled generation can be stopped)
+        on_first_paragraph: With stream=True, called once with the first
+            complete paragraph as soon as it has been generated
+        priority, user_id: Scheduling class ("chat", "summary") and user,
+            see utils/agent/llm_scheduler.py
+
+    Returns:
+        The full answer text
+
+    Raises:
+        LLMBusyError if the request was shed or waited past its deadline
+    """
+    if stats is None:
+        stats = {}
+
+    # Wait for a free model slot; chat goes before background summaries
+    with scheduler.slot(priority, user_id=user_id):
+        return _ollama_chat(prompt, model, stream, max_tokens, max_latency, on_first_paragraph, stats, cancel)
+
+
+def _ollama_chat(prompt, model, stream, max_tokens, max_latency, on_first_paragraph, stats, cancel):
+    if stream or cancel is not None:
+        pieces = []
+        first_paragraph_sent = False
+        for piece in ollama_chat_stream(
+            prompt, model=model, max_tokens=max_tokens, max_latency=max_latency, stats=stats,
+            cancel=cancel,
+        ):
+            pieces.append(piece)
+            if on_first_paragraph and not first_paragraph_sent:
+                text = "".join(pieces).lstrip()
+                if "\n\n" in text:
+                    on_first_paragraph(text.split("\n\n", 1)[0])
+                    first_paragraph_sent = True
+        record_ollama_stats(model, stats)
+        return "".join(pieces)
 
-def ollama_chat(prompt, model="llama3"):
     r = safe_post(
         CHAT_URL,
         {
@@ -27,9 +109,93 @@ def ollama_chat(prompt, model="llama3"):
             f"Try running:\n    ollama pull {model}"
         )
 
+    for key in ("prompt_eval_count", "eval_count", "prompt_eval_duration", "eval_duration"):
+        if key in data:
+            stats[key] = data[key]
+    stats["truncated"] = "max_tokens" if data.get("done_reason") == "length" else None
+    record_ollama_stats(model, stats)
     return data["message"]["content"]
 
 
+def ollama_chat_stream(prompt, model="llama3", max_tokens=None, max_latency=None, stats=None, cancel=None):
+    """
+    Stream a chat completion from Ollama's NDJSON response, yielding content
+    pieces as they are generated.
+
+    Args:
+        prompt: User prompt
+        model: LLM model to use
+        max_tokens: Stop after this many generated tokens (also sent to Ollama
+            as num_predict)
+        max_latency: Stop once generation has taken this many seconds
+        cancel: Optional threading.Event; generation stops once it is set
+        stats: Optional dict filled with ttft (time to first token, seconds),
+            total_time, tokens and truncated ("max_tokens"/"max_latency"/
+            "cancelled"/None),
+            plus prompt_eval_count/eval_count when Ollama reports them
+    """
+    if stats is None:
+        stats = {}
+    stats.update({"ttft": None, "tokens": 0, "truncated": None})
+
+    payload = {
+        "model": model,
+        "stream": True,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ]
+    }
+    if max_tokens:
+        payload["options"] = {"num_predict": max_tokens}
+
+    start = time.time()
+    r = get_client().post(CHAT_URL, payload, stream=True)
+    try:
+        # chunk_size=None hands over data as soon as it arrives instead of buffering
+        for line in r.iter_lines(chunk_size=None):
+            if not line:
+                continue
+            data = json.loads(line)
+
+            if "error" in data:
+                raise ValueError(
+                    f"Ollama returned an error while streaming.\n"
+                    f"Model: {model}\n"
+                    f"Response:\n{data}\n\n"
+                    f"Try running:\n    ollama pull {model}"
+                )
+
+            piece = data.get("message", {}).get("content", "")
+            if piece:
+                if stats["ttft"] is None:
+                    stats["ttft"] = time.time() - start
+                # Ollama streams roughly one token per chunk
+                stats["tokens"] += 1
+                yield piece
+
+            if data.get("done"):
+                for key in ("prompt_eval_count", "eval_count", "prompt_eval_duration", "eval_duration"):
+                    if key in data:
+                        stats[key] = data[key]
+                # Ollama stopped at num_predict itself
+                if data.get("done_reason") == "length":
+                    stats["truncated"] = "max_tokens"
+                break
+            if max_tokens and stats["tokens"] >= max_tokens:
+                stats["truncated"] = "max_tokens"
+                break
+            if max_latency and time.time() - start > max_latency:
+                stats["truncated"] = "max_latency"
+                break
+            if cancel is not None and cancel.is_set():
+                stats["truncated"] = "cancelled"
+                break
+    finally:
+        # Closing the connection early also stops generation on the server
+        r.close()
+        stats["total_time"] = time.time() - start
+
+
 def rag_answer(question, rag, model="llama3"):
     retrieved = rag.retrieve(question)
 
@@ -50,29 +216,7 @@ ANSWER:
     return ollama_chat(prompt, model=model)
 
 
-def rag_answer_with_memory(question, rag, user_id, memory, model="llama3"):
-    """
-    Answer a question using RAG with conversation history
-    
-    Args:
-        question: User's current question
-        rag: RAG instance for document retrieval
-        user_id: User identifier for conversation history
-        memory: ConversationMemory instance
-        model: LLM model to use
-        
-    Returns:
-        Answer string
-    """
-    # Retrieve relevant documents from RAG
-    retrieved = rag.retrieve(question)
-    document_context = "\n\n---\n\n".join([r["chunk"] for r in retrieved])
-    
-    # Retrieve conversation history
-    conversation_history = memory.format_history_for_prompt(user_id)
-    
-    # Build enhanced prompt with conversation history and document context
-    prompt = f"""You are a helpful AI assistant with access to both document knowledge and conversation history.
+MEMORY_PROMPT_TEMPLATE = """You are a helpful AI assistant with access to both document knowledge and conversation history.
 
 {conversation_history}
 INSTRUCTIONS:
@@ -91,12 +235,103 @@ CURRENT QUESTION FROM USER:
 
 YOUR RESPONSE:
 """
+
+
+def rag_answer_with_memory(
+    question,
+    rag,
+    user_id,
+    memory,
+    model="llama3",
+    answer_cache=None,
+    prompt_builder=None,
+    cancel=None,
+    commit=None,
+    **chat_kwargs,
+):
+    """
+    Answer a question using RAG with conversation history
+    
+    Args:
+        question: User's current question
+        rag: RAG instance for document retrieval
+        user_id: User identifier for conversation history
+        memory: ConversationMemory instance
+        model: LLM model to use
+        answer_cache: Optional SemanticAnswerCache, only used for users
+            without conversation history
+        prompt_builder: PromptBuilder holding the prompt token budget
+            (a default-sized one is used if None)
+        cancel: Optional threading.Event; once set, the remaining stages are
+            skipped and a streaming generation is stopped
+        commit: Optional callable run once the answer is ready, before it is
+            stored; if it returns False the answer is thrown away
+        chat_kwargs: Passed to ollama_chat (stream, max_tokens, max_latency,
+            on_first_paragraph, stats). If stats is given, the prompt size
+            report is stored under stats["prompt"].
+        
+    Returns:
+        Answer string, or None if the question was cancelled (cancel set or
+        commit() returned False) and nothing was stored
+    """
+    # Retrieve relevant documents from RAG
+    with stage("retrieve"):
+        retrieved = rag.retrieve(question)
+    if cancel is not None and cancel.is_set():
+        return None
+
+    # A first-turn answer does not depend on history, so it can be shared
+    with stage("history_load"):
+        cacheable = answer_cache is not None and not memory.user_has_history(user_id)
+    if cacheable:
+        with stage("answer_cache"):
+            query_vec = rag.embed_query(question)
+            chunk_ids = [r["id"] for r in retrieved]
+            answer = answer_cache.lookup(query_vec, chunk_ids, model, index_version=rag.index_version)
+        if answer is not None:
+            if commit is not None and not commit():
+                return None
+            with stage("memory_write"):
+                memory.add_exchange(user_id, question, answer)
+            return answer
+    
+    # Build the prompt from history and document context, within the token budget
+    if prompt_builder is None:
+        prompt_builder = PromptBuilder()
+    with stage("history_load"):
+        history = memory.get_history(user_id)
+        summary = memory.get_summary(user_id)
+    with stage("prompt_build"):
+        prompt, prompt_stats = prompt_builder.build(
+            MEMORY_PROMPT_TEMPLATE,
+            question,
+            history,
+            retrieved,
+            summary=summary,
+        )
+    # Needed below to tell whether the answer was cut off
+    if chat_kwargs.get("stats") is None:
+        chat_kwargs["stats"] = {}
+    chat_kwargs["stats"]["prompt"] = prompt_stats
+    trace = current_trace()
+    if trace is not None:
+        trace.set(prompt_tokens=prompt_stats["prompt_tokens"], chunks=prompt_stats["chunks_kept"])
     
     # Get answer from LLM
-    answer = ollama_chat(prompt, model=model)
+    if cancel is not None and cancel.is_set():
+        return None
+    with stage("llm"):
+        answer = ollama_chat(prompt, model=model, cancel=cancel, user_id=user_id, **chat_kwargs)
+    if commit is not None and not commit():
+        return None
+
+    # Only complete answers grounded in documents are shared with other users
+    if cacheable and answer.strip() and retrieved and not chat_kwargs["stats"].get("truncated"):
+        answer_cache.store(query_vec, chunk_ids, model, answer, index_version=rag.index_version)
     
     # Store this exchange in conversation history
-    memory.add_exchange(user_id, question, answer)
+    with stage("memory_write"):
+        memory.add_exchange(user_id, question, answer)
     
     return answer
 
@@ -110,7 +345,7 @@ if __name__ == "__main__":
     rag = RAG(
         client=None,
         folder="documents",
-        batch_size=5
+        batch_size=32
     )
 
     print("Index built.")
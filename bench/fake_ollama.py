@@ -0,0 +1,242 @@
+"""
+Local stand-in for Ollama (and the LINE Messaging API) for benchmarks, so
+runs are repeatable and need no GPU, model download or LINE channel.
+
+Ollama endpoints:
+    GET  /                  health check
+    POST /api/embeddings    {"prompt"} -> {"embedding"}
+    POST /api/embed         {"input": [...]} -> {"embeddings"}
+    POST /api/chat          streaming (NDJSON) and non-streaming, with
+                            prompt_eval_count/eval_count and durations
+
+Embeddings are deterministic: the sum of a fixed random vector per word, so
+the same text always gets the same vector and texts sharing words are close.
+Latency is simulated with sleeps (see --help).
+
+LINE endpoints (point the bot at it with LINE_API_HOST=http://127.0.0.1:11434):
+    POST /v2/bot/message/reply, /v2/bot/message/push
+    GET  /bench/replies     when each reply token / user was answered
+
+    uv run python -m bench.fake_ollama --dim 1024 --chat-ttft 0.3
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+_WORD_RE = re.compile(r"[぀-ヿ㐀-鿿가-힯]|\w+")
+
+
+class FakeOllamaConfig:
+    def __init__(self, dim=1024, embed_latency=0.0, chat_ttft=0.0, token_latency=0.0, answer_tokens=60):
+        """
+        Args:
+            dim: Embedding dimension
+            embed_latency: Seconds per embedding request (a batch counts once)
+            chat_ttft: Seconds before the first generated token (prompt eval)
+            token_latency: Seconds per generated token
+            answer_tokens: Tokens in every chat answer
+        """
+        self.dim = dim
+        self.embed_latency = embed_latency
+        self.chat_ttft = chat_ttft
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+
+
+@lru_cache(maxsize=100000)
+def _word_vector(word, dim):
+    seed = int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16)
+    return np.random.default_rng(seed).standard_normal(dim).astype("float32")
+
+
+def fake_embedding(text, dim):
+    """Deterministic unit vector for text"""
+    vector = np.zeros(dim, dtype="float32")
+    for word in _WORD_RE.findall(text.lower()) or [text]:
+        vector += _word_vector(word, dim)
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+def fake_answer(tokens):
+    """Answer text of the given number of words, split into paragraphs"""
+    words = [f"word{i % 50}" for i in range(tokens)]
+    for i in range(20, tokens, 20):
+        words[i - 1] += ".\n\n"
+    return " ".join(words)
+
+
+def _count_tokens(text):
+    return max(len(text) // 4, 1)
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = FakeOllamaConfig()
+    # reply token / user id -> time.time() the LINE message arrived
+    replies = {}
+    pushes = {}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, obj):
+        data = (json.dumps(obj) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n" % len(data) + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/bench/replies":
+            with self.lock:
+                self._send_json({"replies": dict(self.replies), "pushes": dict(self.pushes)})
+            return
+        body = b"Ollama is running"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path == "/api/embeddings":
+            time.sleep(self.config.embed_latency)
+            self._send_json({"embedding": fake_embedding(body["prompt"], self.config.dim)})
+        elif self.path == "/api/embed":
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            time.sleep(self.config.embed_latency)
+            self._send_json({
+                "model": body.get("model"),
+                "embeddings": [fake_embedding(text, self.config.dim) for text in inputs],
+            })
+        elif self.path == "/api/chat":
+            self._chat(body)
+        elif self.path in ("/v2/bot/message/reply", "/v2/bot/message/push"):
+            with self.lock:
+                if self.path.endswith("reply"):
+                    self.replies[body["replyToken"]] = time.time()
+                else:
+                    self.pushes.setdefault(body["to"], []).append(time.time())
+            self._send_json({"sentMessages": [{"id": "0", "quoteToken": "bench"}]})
+        else:
+            self._send_json({"error": f"unknown path {self.path}"}, status=404)
+
+    def _chat(self, body):
+        config = self.config
+        prompt = "".join(m.get("content", "") for m in body.get("messages", []))
+        prompt_tokens = _count_tokens(prompt)
+
+        if body.get("format") == "json":
+            # LLM reranking: one score per "Passage N:" in the prompt
+            count = len(re.findall(r"^Passage \d+:", prompt, re.MULTILINE))
+            content = json.dumps({"scores": [10 - i % 10 for i in range(count)]})
+            tokens = [content]
+        else:
+            limit = (body.get("options") or {}).get("num_predict")
+            n = config.answer_tokens if limit is None or limit < 0 else min(limit, config.answer_tokens)
+            tokens = [word + " " for word in fake_answer(n).split(" ")]
+
+        start = time.time()
+        time.sleep(config.chat_ttft)
+        prompt_eval_ns = int((time.time() - start) * 1e9)
+        final = {
+            "model": body.get("model"),
+            "done": True,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": prompt_eval_ns,
+            "eval_count": len(tokens),
+        }
+
+        if not body.get("stream", True):
+            time.sleep(config.token_latency * len(tokens))
+            final["eval_duration"] = int((time.time() - start) * 1e9) - prompt_eval_ns
+            final["total_duration"] = int((time.time() - start) * 1e9)
+            final["message"] = {"role": "assistant", "content": "".join(tokens)}
+            self._send_json(final)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for token in tokens:
+                time.sleep(config.token_latency)
+                self._write_chunk({
+                    "model": body.get("model"),
+                    "message": {"role": "assistant", "content": token},
+                    "done": False,
+                })
+            final["eval_duration"] = int((time.time() - start) * 1e9) - prompt_eval_ns
+            final["total_duration"] = int((time.time() - start) * 1e9)
+            final["message"] = {"role": "assistant", "content": ""}
+            self._write_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client stopped reading (max_tokens / max_latency reached)
+            pass
+
+
+def serve(host="127.0.0.1", port=11434, config=None):
+    """Start the stub in a daemon thread and return the server (call .shutdown() to stop)"""
+    handler = type("Handler", (FakeOllamaHandler,), {
+        "config": config or FakeOllamaConfig(),
+        "replies": {},
+        "pushes": {},
+        "lock": threading.Lock(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--dim", type=int, default=1024, help="embedding dimension (mxbai-embed-large: 1024)")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="seconds per embedding request")
+    parser.add_argument("--chat-ttft", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="seconds per generated token")
+    parser.add_argument("--answer-tokens", type=int, default=60, help="tokens per chat answer")
+
+
+def config_from_args(args):
+    return FakeOllamaConfig(
+        dim=args.dim,
+        embed_latency=args.embed_latency,
+        chat_ttft=args.chat_ttft,
+        token_latency=args.token_latency,
+        answer_tokens=args.answer_tokens,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, config_from_args(args))
+    print(f"Fake Ollama listening on http://{args.host}:{args.port} (dim {args.dim})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
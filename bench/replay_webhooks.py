@@ -0,0 +1,189 @@
+"""
+Replay signed LINE webhook message events against a running bot at a fixed
+rate and report how fast /callback acknowledges them and, with --stub, how
+long until each reply reached the (fake) LINE API.
+
+Start the stub and the bot pointed at it, then replay:
+
+    uv run python -m bench.fake_ollama
+    OLLAMA_HOST=http://127.0.0.1:11434 LINE_API_HOST=http://127.0.0.1:11434 \\
+        LINE_CHANNEL_SECRET=bench LINE_CHANNEL_ACCESS_TOKEN=bench uv run main.py --debounce 0
+    uv run python -m bench.replay_webhooks --secret bench --rate 5 --count 100 \\
+        --stub http://127.0.0.1:11434
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.stats import print_table, save_results, summarize
+
+DEFAULT_QUESTIONS = [
+    "What is advance care planning?",
+    "Who can be my healthcare proxy?",
+    "How do I change my advance directive?",
+    "什麼是預立醫療照護諮商?",
+    "What happens if I cannot make decisions for myself?",
+    "Do I need a lawyer to write an advance directive?",
+]
+
+
+def make_message_event(user_id, text, reply_token=None, timestamp=None):
+    """LINE webhook body with one text message event"""
+    return {
+        "destination": "Ubench",
+        "events": [{
+            "type": "message",
+            "mode": "active",
+            "timestamp": int((timestamp or time.time()) * 1000),
+            "webhookEventId": uuid.uuid4().hex.upper(),
+            "deliveryContext": {"isRedelivery": False},
+            "source": {"type": "user", "userId": user_id},
+            "replyToken": reply_token or uuid.uuid4().hex,
+            "message": {"type": "text", "id": str(uuid.uuid4().int)[:18], "quoteToken": "bench", "text": text},
+        }],
+    }
+
+
+def sign(body, channel_secret):
+    """X-Line-Signature: base64 HMAC-SHA256 of the body with the channel secret"""
+    digest = hmac.new(channel_secret.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("utf-8")
+
+
+def answered_by(sent, replies):
+    """
+    When the bot debounces, one reply (to the newest message of a burst)
+    answers all of the user's earlier messages that had no reply yet.
+
+    Args:
+        sent: {reply token: (user id, send time)}
+        replies: {reply token: time the reply arrived}
+
+    Returns:
+        {reply token: time the message was answered} for answered messages
+    """
+    answered = {}
+    waiting = {}  # user id -> tokens not answered yet, oldest first
+    for token, (user_id, _) in sorted(sent.items(), key=lambda item: item[1][1]):
+        waiting.setdefault(user_id, []).append(token)
+        if token in replies:
+            for earlier in waiting.pop(user_id):
+                answered[earlier] = replies[token]
+    return answered
+
+
+def replay(url, channel_secret, rate=5.0, count=100, users=10, questions=None, stub=None, timeout=120.0):
+    """
+    Post count signed message events to url, rate per second (open loop:
+    sends are not held back by slow responses), round-robin over users.
+    With debouncing on in the bot, end-to-end latency includes the time a
+    message waited for the rest of its burst.
+
+    Args:
+        stub: Base URL of bench.fake_ollama acting as the LINE API; if
+            given, wait for the replies and measure end-to-end latency
+        timeout: Seconds to wait for outstanding replies
+
+    Returns:
+        List of summaries (see bench.stats.summarize)
+    """
+    questions = questions or DEFAULT_QUESTIONS
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=64)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    sent = {}      # reply token -> (user id, send time)
+    acks = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def post(i, reply_token, user_id):
+        body = json.dumps(make_message_event(user_id, questions[i % len(questions)], reply_token))
+        start = time.time()
+        try:
+            r = session.post(
+                url, data=body, timeout=30,
+                headers={"Content-Type": "application/json", "X-Line-Signature": sign(body, channel_secret)},
+            )
+            status = r.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        with lock:
+            acks.append(time.time() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                sent[reply_token] = (user_id, start)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        for i in range(count):
+            # Keep to the schedule even if earlier requests are still running
+            delay = start + i / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(post, i, uuid.uuid4().hex, f"U{i % users:032x}")
+    send_seconds = time.time() - start
+
+    print(f"Sent {count} events in {send_seconds:.1f}s, responses: {statuses}")
+    results = [summarize("webhook_ack", acks, send_seconds, unit="req")]
+
+    if stub:
+        replies = {}
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            replies = session.get(f"{stub}/bench/replies", timeout=10).json()["replies"]
+            if all(token in replies for token in sent):
+                break
+            time.sleep(0.5)
+
+        answered = answered_by(sent, replies)
+        combined = sum(1 for token in answered if token not in replies)
+        if len(answered) < len(sent):
+            print(f"{len(sent) - len(answered)} message(s) not answered within {timeout:.0f}s")
+        if combined:
+            print(f"{combined} message(s) answered together with a later one (debounced)")
+        latencies = [answered[token] - sent[token][1] for token in answered]
+        wall = max(answered.values()) - start if answered else None
+        results.append(summarize("message_end_to_end", latencies, wall, unit="msg"))
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:25565/callback")
+    parser.add_argument("--secret", default=os.getenv("LINE_CHANNEL_SECRET"), help="channel secret the bot verifies with")
+    parser.add_argument("--rate", type=float, default=5.0, help="events per second")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--users", type=int, default=10, help="distinct user ids")
+    parser.add_argument("--questions", help="file with one question per line")
+    parser.add_argument("--stub", help="fake LINE API base URL, to measure end-to-end latency")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", help="save the results to this file")
+    args = parser.parse_args()
+
+    if not args.secret:
+        parser.error("--secret or LINE_CHANNEL_SECRET is required to sign the events")
+
+    questions = None
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    results = replay(
+        args.url, args.secret, rate=args.rate, count=args.count, users=args.users,
+        questions=questions, stub=args.stub, timeout=args.timeout,
+    )
+    print_table(results)
+    if args.json:
+        save_results(results, args.json)
@@ -0,0 +1,261 @@
+"""
+Benchmark index build, retrieval, conversation memory I/O and end-to-end
+message handling against the fake Ollama in bench/fake_ollama.py, and report
+p50/p95/p99 latency and throughput for each.
+
+    uv run python -m bench.run_benchmarks                      # components only
+    uv run python -m bench.run_benchmarks --e2e                # also run main.py and replay webhooks
+    uv run python -m bench.run_benchmarks --json bench.json    # save results
+    uv run python -m bench.run_benchmarks --baseline bench.json  # exit 1 if p95 regressed
+
+Everything is written to a temporary directory; the stub's latencies are
+fixed, so differences between runs come from this code.
+"""
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.fake_ollama import add_config_arguments, config_from_args, serve
+from bench.replay_webhooks import DEFAULT_QUESTIONS, replay
+from bench.stats import compare_to_baseline, print_table, save_results, summarize
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def prepare_corpus(source, target, copies=1):
+    """Copy the documents, copies times over (with distinct contents) for a bigger corpus"""
+    os.makedirs(target, exist_ok=True)
+    for name in sorted(os.listdir(source)):
+        path = os.path.join(source, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        stem, ext = os.path.splitext(name)
+        for i in range(copies):
+            with open(os.path.join(target, f"{stem}_{i}{ext}"), "w", encoding="utf-8") as f:
+                f.write(f"Copy {i}\n\n{text}" if i else text)
+
+
+def bench_index(RAG, rag_kwargs, runs):
+    """Cold build, then read-only loads of the result"""
+    results = []
+
+    start = time.time()
+    rag = RAG(**rag_kwargs, batch_size=32)
+    build_seconds = time.time() - start
+    chunks = rag.index.ntotal
+    print(f"Built index of {chunks} chunks in {build_seconds:.2f}s ({chunks / build_seconds:.0f} chunks/s)")
+    results.append(summarize("index_build", [build_seconds], unit="build"))
+    results.append(summarize("index_build_chunks", [build_seconds / chunks] * chunks, build_seconds, unit="chunk"))
+
+    loads = []
+    for _ in range(runs):
+        start = time.time()
+        RAG(**rag_kwargs, read_only=True)
+        loads.append(time.time() - start)
+    results.append(summarize("index_load_readonly", loads, unit="load"))
+    return rag, results
+
+
+def bench_retrieval(rag, queries, concurrency):
+    results = []
+
+    def timed(query):
+        start = time.time()
+        rag.retrieve(query)
+        return time.time() - start
+
+    # Distinct queries, so the query embedding cache does not hide the embedding call
+    latencies = [timed(f"{query} ({i})") for i, query in enumerate(queries)]
+    results.append(summarize("retrieve", latencies))
+
+    cached = [timed(f"{query} ({i})") for i, query in enumerate(queries)]
+    results.append(summarize("retrieve_cached_query", cached))
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        parallel = list(pool.map(timed, [f"{query} [{i}]" for i, query in enumerate(queries)]))
+    results.append(summarize(f"retrieve_x{concurrency}", parallel, time.time() - start))
+    return results
+
+
+def bench_memory(ConversationMemory, workdir, users, exchanges):
+    """Write-through and uncached reads for every storage backend"""
+    results = []
+    answer = "An answer of typical length. " * 20
+    for backend in ("text", "jsonl", "sqlite"):
+        # cache_size=0: every read goes to the backend
+        memory = ConversationMemory(
+            storage_dir=os.path.join(workdir, f"memory_{backend}"),
+            max_history=4,
+            backend=backend,
+            cache_size=0,
+        )
+        writes, reads = [], []
+        for n in range(exchanges):
+            for u in range(users):
+                user_id = f"U{u:032x}"
+                start = time.time()
+                memory.add_exchange(user_id, f"Question {n} from {u}?", answer)
+                writes.append(time.time() - start)
+
+                start = time.time()
+                memory.format_history_for_prompt(user_id)
+                reads.append(time.time() - start)
+        results.append(summarize(f"memory_write_{backend}", writes))
+        results.append(summarize(f"memory_read_{backend}", reads))
+    return results
+
+
+def bench_end_to_end(args, workdir, docs, stub_url):
+    """Run main.py against the stub and replay signed webhooks at it"""
+    port = _free_port()
+    secret = "bench-secret"
+    env = dict(
+        os.environ,
+        OLLAMA_HOST=stub_url,
+        LINE_API_HOST=stub_url,
+        LINE_CHANNEL_SECRET=secret,
+        LINE_CHANNEL_ACCESS_TOKEN="bench-token",
+        PYTHONUNBUFFERED="1",
+    )
+    command = [
+        sys.executable, os.path.join(REPO_ROOT, "main.py"),
+        "--host", "127.0.0.1", "--port", str(port),
+        "--index-mode", "build", "--folder", docs, "--index-dir", os.path.join(workdir, "rag"),
+        "--rerank", args.rerank,
+        "--debounce", str(args.debounce),
+    ]
+    if args.stream:
+        command.append("--stream")
+
+    os.makedirs(workdir, exist_ok=True)
+    log_path = os.path.join(workdir, "server.log")
+    with open(log_path, "w") as log:
+        server = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        base = f"http://127.0.0.1:{port}"
+        deadline = time.time() + 300
+        while True:
+            if server.poll() is not None or time.time() > deadline:
+                raise RuntimeError(f"Bot did not start, see {log_path}")
+            try:
+                if requests.get(f"{base}/metrics", timeout=1).ok:
+                    break
+            except requests.RequestException:
+                time.sleep(0.5)
+
+        results = replay(
+            f"{base}/callback", secret, rate=args.rate, count=args.messages,
+            users=args.users, stub=stub_url,
+        )
+        print_stage_means(requests.get(f"{base}/metrics", timeout=5).text)
+        return results
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def print_stage_means(metrics_text):
+    """Mean time per stage from the bot's stage_seconds histogram"""
+    sums, counts = {}, {}
+    for line in metrics_text.splitlines():
+        if line.startswith("stage_seconds_sum") or line.startswith("stage_seconds_count"):
+            name, value = line.rsplit(" ", 1)
+            stage_name = name.split('stage="', 1)[1].split('"', 1)[0]
+            target = sums if name.startswith("stage_seconds_sum") else counts
+            target[stage_name] = float(value)
+    print("\nServer-side stage means:")
+    for stage_name in sorted(sums, key=sums.get, reverse=True):
+        if counts.get(stage_name):
+            print(f"  {stage_name:<16}{sums[stage_name] / counts[stage_name] * 1000:9.2f} ms  (n={counts[stage_name]:.0f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", default=os.path.join(REPO_ROOT, "documents"))
+    parser.add_argument("--copies", type=int, default=1, help="repeat the corpus this many times")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--load-runs", type=int, default=5)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--exchanges", type=int, default=10, help="exchanges written per user")
+    parser.add_argument("--e2e", action="store_true", help="also benchmark main.py with replayed webhooks")
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=5.0, help="webhook events per second")
+    parser.add_argument("--stream", action="store_true", help="run the bot with --stream")
+    parser.add_argument("--debounce", type=float, default=0.0,
+                        help="the bot's --debounce; 0 answers every message on its own")
+    parser.add_argument("--rerank", choices=["none", "mmr", "llm"], default="mmr")
+    parser.add_argument("--json", help="save the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare p95 against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown vs the baseline")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    stub_port = _free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    stub = serve(port=stub_port, config=config_from_args(args))
+    # The Ollama URLs are read at import time, so point them at the stub first
+    os.environ["OLLAMA_HOST"] = stub_url
+    from utils.agent.RAG import RAG
+    from utils.agent.conversation_memory import ConversationMemory
+
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    docs = os.path.join(workdir, "documents")
+    prepare_corpus(args.docs, docs, args.copies)
+    rag_kwargs = dict(
+        client=None,
+        folder=docs,
+        index_path=os.path.join(workdir, "rag", "faiss.index"),
+        manifest_path=os.path.join(workdir, "rag", "manifest.json"),
+        chunk_store_path=os.path.join(workdir, "rag", "chunks"),
+        bm25_path=os.path.join(workdir, "rag", "bm25"),
+        vectors_path=os.path.join(workdir, "rag", "vectors.f32"),
+    )
+
+    try:
+        results = []
+        rag, index_results = bench_index(RAG, rag_kwargs, args.load_runs)
+        results += index_results
+
+        queries = [DEFAULT_QUESTIONS[i % len(DEFAULT_QUESTIONS)] for i in range(args.queries)]
+        results += bench_retrieval(rag, queries, args.concurrency)
+        results += bench_memory(ConversationMemory, workdir, args.users, args.exchanges)
+
+        if args.e2e:
+            results += bench_end_to_end(args, os.path.join(workdir, "e2e"), docs, stub_url)
+
+        print()
+        print_table(results)
+        if args.json:
+            save_results(results, args.json)
+
+        if args.baseline:
+            regressions = compare_to_baseline(results, args.baseline, args.tolerance)
+            for line in regressions:
+                print(f"REGRESSION: {line}")
+            if regressions:
+                sys.exit(1)
+    finally:
+        stub.shutdown()
+        if args.keep:
+            print(f"Benchmark files kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,79 @@
+import json
+
+
+def percentile(samples, q):
+    """q-th percentile (0-100) with linear interpolation between samples"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    pos = (len(ordered) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def summarize(name, latencies, wall_seconds=None, unit="ops"):
+    """
+    Args:
+        name: Benchmark name
+        latencies: Seconds per operation
+        wall_seconds: Elapsed time for all operations (they may overlap);
+            defaults to the sum of the latencies
+        unit: What one operation is, for the throughput column
+
+    Returns:
+        {"name", "count", "p50_ms", "p95_ms", "p99_ms", "max_ms",
+        "throughput", "unit"}
+    """
+    if wall_seconds is None:
+        wall_seconds = sum(latencies)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        "name": name,
+        "count": len(latencies),
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(max(latencies) if latencies else None),
+        "throughput": round(len(latencies) / wall_seconds, 2) if wall_seconds else None,
+        "unit": unit,
+    }
+
+
+def print_table(results):
+    print(f"{'benchmark':<28}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  throughput")
+    for r in results:
+        cells = [
+            "-" if r[key] is None else f"{r[key]:.2f}"
+            for key in ("p50_ms", "p95_ms", "p99_ms", "max_ms")
+        ]
+        throughput = "-" if r["throughput"] is None else f"{r['throughput']:.2f} {r['unit']}/s"
+        print(f"{r['name']:<28}{r['count']:>7}" + "".join(f"{c:>10}" for c in cells) + f"  {throughput}")
+
+
+def save_results(results, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+
+def compare_to_baseline(results, baseline_path, tolerance=0.2):
+    """
+    Compare p95 latencies with a previous run saved by save_results.
+
+    Returns:
+        List of "name: p95 X ms -> Y ms" lines for benchmarks that got more
+        than tolerance (fraction) slower
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {r["name"]: r for r in json.load(f)}
+
+    regressions = []
+    for r in results:
+        before = baseline.get(r["name"], {}).get("p95_ms")
+        after = r["p95_ms"]
+        if before and after and after > before * (1 + tolerance):
+            regressions.append(f"{r['name']}: p95 {before:.2f} ms -> {after:.2f} ms")
+    return regressions
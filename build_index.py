@@ -0,0 +1,166 @@
+"""
+Build, verify or inspect the RAG index artifacts offline, so the server can
+start by loading them read-only instead of embedding the corpus.
+
+    uv run build_index.py build             # embed new/changed documents
+    uv run build_index.py verify            # exit 1 if artifacts are unusable or stale
+    uv run build_index.py inspect           # print what the artifacts contain
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+
+from utils.agent.RAG import RAG, IndexMismatchError
+from utils.agent.llm_scheduler import scheduler
+from utils.agent.index_factory import INDEX_TYPES, compression_of, index_memory_bytes, index_type_of
+
+
+def rag_kwargs(args):
+    """RAG settings shared by this tool and main.py (--index-dir etc.)"""
+    return dict(
+        client=None,
+        folder=args.folder,
+        index_path=os.path.join(args.index_dir, "faiss.index"),
+        manifest_path=os.path.join(args.index_dir, "manifest.json"),
+        chunks_path=os.path.join(args.index_dir, "faiss_chunks.json"),
+        chunk_store_path=os.path.join(args.index_dir, "chunks"),
+        bm25_path=os.path.join(args.index_dir, "bm25"),
+        vectors_path=os.path.join(args.index_dir, "vectors.f32"),
+        compression=None if args.compression == "none" else args.compression,
+        embed_model=args.embed_model,
+        chunker=args.chunker,
+        chunk_tokens=args.chunk_tokens,
+        index_type=args.index_type,
+    )
+
+
+def add_index_arguments(parser):
+    parser.add_argument("--folder", default="documents", help="document folder")
+    parser.add_argument("--index-dir", default="rag", help="where the index artifacts live")
+    parser.add_argument("--embed-model", default="mxbai-embed-large")
+    parser.add_argument("--chunker", choices=["markdown", "fixed"], default="markdown")
+    parser.add_argument("--chunk-tokens", type=int, default=480)
+    parser.add_argument("--compression", choices=["none", "fp16", "sq8", "pq"], default="none",
+                        help="store index vectors quantized (float32 copies stay on disk for re-scoring)")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="auto")
+
+
+def _dir_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def build(args):
+    start = time.time()
+    # Embedding batches take scheduler slots; offline there is nothing to
+    # share Ollama with, so allow as many as there are workers
+    scheduler.configure(max_concurrent=args.max_workers)
+    rag = RAG(
+        **rag_kwargs(args),
+        batch_size=args.batch_size,
+        max_workers=args.max_workers,
+    )
+    if rag.index is None:
+        print("No documents to index")
+        return 1
+    print(f"Index ready in {time.time() - start:.1f}s")
+    print(json.dumps(rag.manifest["artifact"], indent=2, ensure_ascii=False))
+    return 0
+
+
+def verify(args):
+    start = time.time()
+    try:
+        rag = RAG(**rag_kwargs(args), read_only=True)
+    except IndexMismatchError as e:
+        print(f"FAIL: {e}")
+        return 1
+    print(f"Loaded read-only in {time.time() - start:.2f}s")
+
+    ok = True
+    artifact = rag.manifest["artifact"]
+    if artifact["corpus_hash"] != rag.index_version:
+        print("FAIL: corpus hash does not match the manifest's document list")
+        ok = False
+
+    changed, removed = rag.stale_documents()
+    for path in changed:
+        print(f"STALE: {path} is new or changed since the build")
+    for path in removed:
+        print(f"STALE: {path} was deleted since the build")
+    ok = ok and not changed and not removed
+
+    # Every indexed ID must have its text, and stored vectors must find themselves
+    ids = rag.chunk_store.ids()
+    for chunk_id in ids[:: max(len(ids) // 20, 1)].tolist():
+        rag.chunk_store.get(chunk_id)
+        vector = rag.index.reconstruct(chunk_id).reshape(1, -1)
+        _, found = rag.index.search(vector, 5)
+        if chunk_id not in found[0].tolist():
+            print(f"WARN: chunk {chunk_id} is not among the neighbours of its own vector")
+
+    print("OK" if ok else "Index needs a rebuild: run build_index.py build")
+    return 0 if ok else 1
+
+
+def inspect(args):
+    manifest_path = os.path.join(args.index_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        print(f"No manifest at {manifest_path}")
+        return 1
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    print("Artifact:")
+    print(json.dumps(manifest.get("artifact"), indent=2, ensure_ascii=False))
+    if manifest.get("pending"):
+        print(f"Unfinished build: {manifest['pending']}")
+
+    print("\nDocuments:")
+    for path, entry in sorted(manifest["files"].items()):
+        print(f"  {path}: {entry['end_id'] - entry['start_id']} chunks, sha256 {entry['hash'][:12]}")
+
+    print("\nFiles:")
+    for name in ("faiss.index", "manifest.json", "bm25", "chunks", "vectors.f32"):
+        path = os.path.join(args.index_dir, name)
+        if os.path.exists(path):
+            print(f"  {name}: {_dir_size(path) / 1e6:.2f} MB")
+
+    index_path = os.path.join(args.index_dir, "faiss.index")
+    if os.path.exists(index_path):
+        index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        size = index_memory_bytes(index)
+        print(f"\nFAISS: {index.ntotal} vectors, dim {index.d}, {size / 1e6:.2f} MB serialized")
+        float32_size = index.ntotal * index.d * 4
+        if float32_size:
+            print(f"  vectors take {size / float32_size:.0%} of their float32 size "
+                  f"(compression: {compression_of(index)}, type: {index_type_of(index)})")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="build or incrementally update the index")
+    add_index_arguments(build_parser)
+    build_parser.add_argument("--batch-size", type=int, default=32)
+    build_parser.add_argument("--max-workers", type=int, default=4)
+
+    verify_parser = commands.add_parser("verify", help="check the artifacts load read-only and are up to date")
+    add_index_arguments(verify_parser)
+
+    inspect_parser = commands.add_parser("inspect", help="print artifact metadata and sizes")
+    add_index_arguments(inspect_parser)
+
+    args = parser.parse_args()
+    sys.exit({"build": build, "verify": verify, "inspect": inspect}[args.command](args))
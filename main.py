@@ -1,8 +1,9 @@
-from flask import Flask, request, abort
+import os
+import queue
+import time
+
+from flask import Flask, Response, request, abort
 
-from linebot.v3 import (
-    WebhookHandler
-)
 from linebot.v3.exceptions import (
     InvalidSignatureError
 )
@@ -25,30 +26,62 @@ from linebot.v3.webhooks import (
 
 
 # Import RAG and conversation memory
-from utils.agent.RAG import RAG
+from utils.agent.RAG import RAG, IndexMismatchError
+from utils.agent.doc_watcher import ReloadableRAG
+from utils.agent.reranker import Reranker
+from build_index import rag_kwargs
 from LLM import rag_answer_with_memory
 from utils.agent.conversation_memory import ConversationMemory
-from summarizer import summarize_user_knowledge
+from utils.agent.answer_cache import SemanticAnswerCache
+from utils.agent.prompt_builder import PromptBuilder
+from utils.agent.llm_scheduler import scheduler, LLMBusyError
+from summarizer import summarize_user_knowledge, fold_exchanges_into_summary
 
 # helper function from utils
 import utils.env
 from utils.args import parse_arguments
 from utils.email import send_email_with_attachment
+from utils.linebot_widget.job_queue import UserOrderedJobQueue, AsyncWebhookHandler
+from utils.linebot_widget.reply import send_text, push_text
+from utils.linebot_widget.dedup import SeenEventStore
+from utils.linebot_widget.coalescer import Burst, MessageCoalescer
+from utils.metrics import metrics, trace
 
 app = Flask(__name__)
 
-configuration = Configuration(access_token=utils.env.LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(utils.env.LINE_CHANNEL_SECRET)
+configuration = Configuration(
+    access_token=utils.env.LINE_CHANNEL_ACCESS_TOKEN, host=utils.env.LINE_API_HOST
+)
 
-# Initialize RAG and conversation memory globally
-print("Initializing RAG system...")
-rag_system = RAG(client=None, folder="documents", batch_size=5)
-print("RAG system initialized.")
+# Events are handled on a worker pool so /callback can acknowledge LINE at once;
+# each user's events stay in order on the same worker. Redelivered events are
+# dropped before they are queued.
+job_queue = UserOrderedJobQueue(num_workers=4)
+seen_events = SeenEventStore(ttl=3600, max_entries=10000)
+handler = AsyncWebhookHandler(
+    utils.env.LINE_CHANNEL_SECRET, job_queue=job_queue, seen_events=seen_events
+)
+
+# Set up in __main__ from the --index-* arguments (see create_rag_system)
+rag_system = None
 
 print("Initializing conversation memory...")
-conversation_memory = ConversationMemory(storage_dir="conversation_history", max_history=10)
+# Exchanges that fall out of the window are folded into a per-user summary
+conversation_memory = ConversationMemory(
+    storage_dir="conversation_history",
+    max_history=4,
+    backend="sqlite",
+    summarize_fn=lambda summary, exchanges: fold_exchanges_into_summary(
+        summary, exchanges, model=args.model
+    ),
+)
 print("Conversation memory initialized.")
 
+BUSY_REPLY = "I'm answering a lot of questions right now, please try again in a minute. 🙏"
+
+# Shares answers between near-duplicate first-turn questions
+answer_cache = SemanticAnswerCache(threshold=0.95, ttl=3600, max_entries=512)
+
 
 @app.route("/callback", methods=['POST'])
 def callback():
@@ -59,25 +92,51 @@ def callback():
     body = request.get_data(as_text=True)
     app.logger.info("Request body: " + body)
 
-    # handle webhook body
+    # verify signature and queue the events; handlers run on the worker pool
     try:
         handler.handle(body, signature)
     except InvalidSignatureError:
         app.logger.info("Invalid signature. Please check your channel access token/channel secret.")
         abort(400)
+    except queue.Full:
+        app.logger.warning("Webhook job queue is full, rejecting request.")
+        abort(503)
 
     return 'OK'
 
+
+@app.route("/metrics", methods=['GET'])
+def metrics_route():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def _register_gauges():
+    def rag_stat(key):
+        # The RAG instance (and its query cache) is replaced on reloads
+        return lambda: rag_system.current.query_cache.stats()[key]
+
+    metrics.gauge("query_embedding_cache_hit_rate", rag_stat("hit_rate"), "Query embedding cache hit rate")
+    metrics.gauge("query_embedding_cache_entries", rag_stat("entries"))
+    metrics.gauge("answer_cache_hit_rate", lambda: answer_cache.stats()["hit_rate"], "Semantic answer cache hit rate")
+    metrics.gauge("answer_cache_entries", lambda: answer_cache.stats()["entries"])
+    metrics.gauge("memory_cache_hit_rate", lambda: conversation_memory.cache_stats()["hit_rate"], "Conversation window cache hit rate")
+    metrics.gauge("job_queue_pending", job_queue.pending, "Webhook events waiting for a worker")
+    if handler.coalescer is not None:
+        metrics.gauge("debounce_pending_users", handler.coalescer.pending, "Users whose messages wait for their burst to end")
+    metrics.gauge("webhook_duplicates", lambda: seen_events.duplicates, "Redelivered webhook events dropped")
+    metrics.gauge("rag_chunks", lambda: rag_system.current.index.ntotal, "Chunks in the serving index")
+    metrics.gauge("rag_reloads", lambda: rag_system.reloads, "Index hot swaps since start")
+    metrics.gauge("llm_running", lambda: scheduler.stats()["running"], "Ollama requests in flight")
+    metrics.gauge(
+        "llm_queued",
+        lambda: {(("priority", p),): n for p, n in scheduler.stats()["queued"].items()},
+        "Ollama requests waiting for a slot",
+    )
+
+
 @handler.add(FollowEvent)
 def handle_follow(event):
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-        line_bot_api.reply_message_with_http_info(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[TextMessage(text="Hello! Thanks for adding me! 🎉\nHow can I help you today?")]
-            )
-        )
+    send_text(configuration, event, "Hello! Thanks for adding me! 🎉\nHow can I help you today?")
 
 @handler.add(UnfollowEvent)
 def handle_unfollow(event):
@@ -88,10 +147,36 @@ def handle_unfollow(event):
 
 @handler.add(MessageEvent, message=TextMessageContent)
 def handle_message(event):
-    # Get user_id from LINE event (or use "user" as default for now)
+    # Commands, or every message if --debounce is 0 (otherwise questions are
+    # collected by handler.coalescer and arrive in answer_burst)
     user_id = getattr(event.source, 'user_id', 'user')
-    user_message = event.message.text.strip()  # get message from user
-    
+    metrics.inc("messages_total")
+    answer_burst(Burst(user_id, [event]))
+
+
+def answer_burst(burst):
+    # One structured trace line per answer, with the time spent in each stage
+    first = burst.events[0]
+    with trace("message", user=burst.user_id, messages=len(burst.events),
+               queue_delay=round(time.time() - first.timestamp / 1000, 3)):
+        try:
+            answer_message(burst)
+        finally:
+            # Answered (or failed): later messages start a new question
+            burst.commit()
+            if handler.coalescer is not None:
+                handler.coalescer.finish(burst)
+
+
+def answer_message(burst):
+    user_id = burst.user_id
+    event = burst.event
+    user_message = burst.question  # the user's messages, one per line
+
+    if burst.cancelled.is_set():
+        print(f"Skipping superseded messages from user {user_id}")
+        return
+
     print(f"Message from user {user_id}: {user_message}")
     
     # Check for special commands
@@ -110,7 +195,14 @@ def handle_message(event):
 
     elif user_message.lower() in ['!send'] and args.email != None:
 
-        text, path = summarize_user_knowledge(user_name=user_id, model=args.model)
+        try:
+            text, path = summarize_user_knowledge(
+                user_name=user_id, model=args.model, memory=conversation_memory
+            )
+        except LLMBusyError as e:
+            print(f"Summary for {user_id} not run: {e}")
+            send_text(configuration, event, BUSY_REPLY)
+            return
 
         success = send_email_with_attachment(
             to_email=args.email,
@@ -124,29 +216,66 @@ def handle_message(event):
         else:
             reply = '信件寄送失敗'
     
+    elif rag_system.current is None:
+        reply = "The knowledge base is still loading, please try again in a minute. 🙏"
+
+    elif not scheduler.try_admit("chat"):
+        # Shed before doing any work: the queue would refuse it anyway
+        print(f"Too many questions waiting, asking {user_id} to retry")
+        reply = BUSY_REPLY
+
     else:
         # Get answer using RAG with conversation memory
+        early_paragraphs = []
+
+        def push_first_paragraph(paragraph):
+            if burst.cancelled.is_set():
+                return
+            push_text(configuration, user_id, paragraph)
+            early_paragraphs.append(paragraph)
+
+        stats = {}
         try:
             reply = rag_answer_with_memory(
                 question=user_message,
-                rag=rag_system,
+                rag=rag_system.current,
                 user_id=user_id,
                 memory=conversation_memory,
-                model=args.model
+                model=args.model,
+                answer_cache=answer_cache,
+                prompt_builder=prompt_builder,
+                stream=args.stream,
+                max_tokens=args.max_tokens,
+                max_latency=args.max_latency,
+                on_first_paragraph=push_first_paragraph if args.early_reply else None,
+                stats=stats,
+                cancel=burst.cancelled,
+                commit=burst.commit,
             )
+            if reply is None:
+                # A newer message arrived; it is answered together with this one
+                print(f"Superseded answer for user {user_id} discarded")
+                return
+            if "prompt" in stats:
+                print(f"Prompt size: ~{stats['prompt']['prompt_tokens']} tokens "
+                      f"({stats['prompt']['history_kept']} history exchange(s), "
+                      f"{stats['prompt']['chunks_kept']} chunk(s))")
+            if stats.get("ttft") is not None:
+                print(f"Time to first token: {stats['ttft']:.2f}s ({stats['tokens']} tokens)")
+
+            # The first paragraph was already pushed, only send the rest
+            if early_paragraphs:
+                reply = reply.lstrip()[len(early_paragraphs[0]):].strip()
+        except LLMBusyError as e:
+            print(f"Question from {user_id} not answered: {e}")
+            reply = BUSY_REPLY
         except Exception as e:
             print(f"Error processing message: {e}")
             reply = "Sorry, I encountered an error processing your request. Please try again. 🤔"
     
-    # Send reply
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-        line_bot_api.reply_message_with_http_info(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[TextMessage(text=reply)]
-            )
-        )
+    # Send reply (push message if the reply token expired while generating)
+    if reply:
+        send_text(configuration, event, reply)
 
 @handler.add(MessageEvent, message=ImageMessageContent)
 def handle_image(event):
@@ -171,6 +300,71 @@ def handle_image(event):
         )
 
 
+def create_rag_system(args):
+    """
+    --index-mode:
+        lazy: load the prebuilt index read-only; if it is missing or does not
+            match the settings, start serving anyway and build it in the
+            background
+        readonly: load the prebuilt index read-only or refuse to start
+            (including when documents changed since it was built)
+        build: build/update the index before serving (slow cold start)
+
+    Outside readonly mode, edits in documents/ are picked up in the
+    background and the updated index is swapped in without a restart.
+    """
+    reranker = Reranker(
+        method=None if args.rerank == "none" else args.rerank,
+        fetch_k=args.rerank_fetch_k,
+        min_similarity=args.min_similarity,
+        llm_model=args.model,
+    )
+    kwargs = dict(
+        rag_kwargs(args),
+        query_cache_path=os.path.join(args.index_dir, "query_cache.sqlite"),
+        reranker=reranker,
+        rescore=args.rescore,
+    )
+
+    def build():
+        return RAG(**kwargs, batch_size=32)
+
+    def load():
+        return RAG(**kwargs, read_only=True)
+
+    print(f"Initializing RAG system ({args.index_mode} mode)...")
+    if args.index_mode == "readonly":
+        try:
+            system = ReloadableRAG(load, folder=args.folder, watch=False)
+        except IndexMismatchError as e:
+            raise SystemExit(f"Refusing to start: {e}")
+        if system.stale:
+            raise SystemExit(
+                f"Refusing to start: {len(system.stale)} document(s) changed since the index was built, "
+                f"run build_index.py build first"
+            )
+    elif args.index_mode == "lazy":
+        system = ReloadableRAG(build, folder=args.folder, loader=load)
+    else:
+        system = ReloadableRAG(build, folder=args.folder)
+    print("RAG system initialized.")
+    return system
+
+
 if __name__ == "__main__":
     args = parse_arguments()
+    scheduler.configure(
+        max_concurrent=args.llm_concurrency,
+        max_queued={"chat": args.llm_queue},
+        deadlines={"chat": args.llm_deadline},
+    )
+    rag_system = create_rag_system(args)
+    if args.debounce > 0:
+        handler.coalescer = MessageCoalescer(
+            submit=lambda burst: job_queue.submit(burst.user_id, answer_burst, burst),
+            window=args.debounce,
+            max_wait=args.debounce_max_wait,
+        )
+    _register_gauges()
+    prompt_builder = PromptBuilder(max_tokens=args.prompt_tokens)
     app.run(host=args.host, port=args.port)
@@ -1,6 +1,6 @@
 
 import os
-from typing import Tuple
+from typing import Dict, List, Tuple
 
 from LLM import ollama_chat
 
@@ -10,9 +10,15 @@ def summarize_user_knowledge(
     history_dir: str = "conversation_history",
     summary_dir: str = "knowledge_summaries",
     model: str = "llama3",
+    memory=None,
 ) -> Tuple[str, str]:
 
-    history_path = os.path.join(history_dir, f"{user_name}.txt")
+    # With a ConversationMemory, export its history in the text format first
+    # (its backend may not keep a .txt file)
+    if memory is not None:
+        history_path = memory.export_text(user_name)
+    else:
+        history_path = os.path.join(history_dir, f"{user_name}.txt")
 
     if not os.path.exists(history_path):
         raise FileNotFoundError(
@@ -35,7 +41,7 @@ CONVERSATION HISTORY:
 
 SUMMARY:"""
 
-    summary_text = ollama_chat(prompt, model=model).strip()
+    summary_text = ollama_chat(prompt, model=model, priority="summary", user_id=user_name).strip()
 
     os.makedirs(summary_dir, exist_ok=True)
     summary_path = os.path.join(summary_dir, f"{user_name}_knowledge.txt")
@@ -44,3 +50,31 @@ SUMMARY:"""
         f.write(summary_text)
 
     return summary_text, summary_path   # Could also have it return nothing
+
+
+
+def fold_exchanges_into_summary(
+    previous_summary: str,
+    exchanges: List[Dict],
+    model: str = "llama3",
+) -> str:
+    """
+    Update a user's running conversation summary with exchanges that fell out
+    of ConversationMemory's window (used as its summarize_fn).
+    """
+    new_text = "\n\n".join(
+        f"User: {ex['question']}\nAssistant: {ex['answer']}" for ex in exchanges
+    )
+
+    prompt = f"""Update the running summary of a conversation between a user and an Advanced Care Planning (ACP) assistant.
+Keep the facts, questions and decisions that could matter later. Be brief: at most 5 sentences. Do not add new facts.
+
+CURRENT SUMMARY:
+{previous_summary or "(none yet)"}
+
+NEW EXCHANGES:
+{new_text}
+
+UPDATED SUMMARY:"""
+
+    return ollama_chat(prompt, model=model, priority="summary").strip()
@@ -1,8 +1,40 @@
+import hashlib
 import json
 import os
+import time
 import faiss
 import numpy as np
-from utils.text_processing import get_chunks, embed_batch_ollama
+from utils.text_processing import (
+    list_document_files,
+    load_text_file,
+    file_content_hash,
+    chunk_text,
+    chunk_document,
+    embed_batch_ollama,
+    embed_batches_concurrent,
+)
+from utils.agent.bm25_index import BM25Index, MappedBM25Index, delete_bm25, reciprocal_rank_fusion
+from utils.agent.chunk_store import ChunkStore
+from utils.agent.vector_store import VectorStore
+from utils.agent.embedding_cache import QueryEmbeddingCache
+from utils.metrics import stage
+from utils.agent.index_factory import (
+    build_index,
+    resolve_index_type,
+    index_type_of,
+    compression_of,
+    exact_rescore,
+    reconstruct_all,
+    set_search_params,
+)
+
+
+# Bumped whenever the on-disk layout of the index artifacts changes
+ARTIFACT_FORMAT = 1
+
+
+class IndexMismatchError(Exception):
+    """Persisted index artifacts are missing or were built with other settings"""
 
 
 class RAG:
@@ -11,107 +43,674 @@ class RAG:
         client,
         folder="documents",
         batch_size=10,
+        max_workers=4,
         index_path="rag/faiss.index",
         chunks_path="rag/faiss_chunks.json",
+        manifest_path="rag/manifest.json",
+        chunk_store_path="rag/chunks",
+        mmap_index=True,
+        bm25_path="rag/bm25",
+        hybrid=True,
+        rrf_k=60,
+        candidates=20,
+        chunker="markdown",
+        chunk_tokens=480,
+        checkpoint_every=2000,
+        embed_model="mxbai-embed-large",
+        query_cache_size=1024,
+        query_cache_path=None,
+        index_type="auto",
+        index_params=None,
+        ef_search=64,
+        nprobe=16,
+        read_only=False,
+        reranker=None,
+        compression=None,
+        rescore=4,
+        vectors_path=None,
     ):
+        """
+        Args:
+            index_type: "flat", "hnsw", "ivfpq" or "auto" (picked from the
+                number of chunks, see index_factory.choose_index_type)
+            index_params: Extra build_index arguments (hnsw_m,
+                ef_construction, nlist, pq_m)
+            ef_search: HNSW search depth (higher = better recall, slower)
+            nprobe: IVF lists visited per query (higher = better recall, slower)
+            chunk_store_path: Directory of the memory-mapped chunk store
+                (chunks_path is only read to migrate the old JSON format)
+            mmap_index: Memory-map the FAISS index read-only, so processes
+                serving the same index share its pages
+            bm25_path: Directory of the memory-mapped lexical (BM25) index
+            hybrid: Fuse BM25 and vector results with reciprocal-rank fusion
+                (False = vector search only)
+            rrf_k: Rank offset in the fusion formula 1 / (rrf_k + rank)
+            candidates: Results taken from each retriever before fusion
+            chunker: "markdown" (split on headings, paragraphs and sentences,
+                see text_processing.chunk_document) or "fixed" (the old
+                1500/200 character windows)
+            chunk_tokens: Maximum estimated tokens per chunk for the
+                markdown chunker (mxbai-embed-large reads at most 512)
+            checkpoint_every: Save progress every this many new chunks while
+                indexing, so an interrupted import can resume
+            read_only: Only load the artifacts written by a previous build
+                (e.g. build_index.py), never embed or write anything. Raises
+                IndexMismatchError if they are missing or were built with a
+                different model or chunker.
+            reranker: Optional reranker.Reranker; retrieve() then fetches
+                reranker.fetch_k candidates and lets it pick the k returned
+            compression: Store flat/HNSW vectors as "fp16", "sq8" or "pq"
+                instead of float32 (see index_factory.COMPRESSIONS)
+            rescore: For compressed indexes (and IVF-PQ), fetch this many
+                times more vector search candidates and re-rank them by exact
+                distance to their float32 vectors, which are kept on disk in
+                vectors_path (0 = use the approximate distances)
+            vectors_path: Defaults to vectors.f32 next to index_path
+        """
         self.client = client
         self.folder = folder
         self.batch_size = batch_size
+        self.max_workers = max_workers
         self.index_path = index_path
         self.chunks_path = chunks_path
+        self.manifest_path = manifest_path
+        self.mmap_index = mmap_index
+        self.bm25_path = bm25_path
+        self.hybrid = hybrid
+        self.rrf_k = rrf_k
+        self.candidates = candidates
+        self.chunker = chunker
+        self.chunk_tokens = chunk_tokens
+        self.checkpoint_every = checkpoint_every
+        self.embed_model = embed_model
+        self.index_type = index_type
+        self.index_params = index_params or {}
+        self.ef_search = ef_search
+        self.nprobe = nprobe
+        self.read_only = read_only
+        self.reranker = reranker
+        self.compression = compression
+        self.rescore = rescore
 
-        # Load chunked data from cache if available; otherwise build and persist
-        self.all_chunks, self.chunk_sources = self._load_or_prepare_chunks()
+        # Repeated questions reuse their query vector instead of calling Ollama
+        self.query_cache = QueryEmbeddingCache(
+            max_entries=query_cache_size, db_path=query_cache_path
+        )
 
-        # Build or load FAISS index
-        self.index = self._load_or_build_index()
+        # Chunk text and source, keyed by the chunk ID stored in the FAISS index
+        self.chunk_store = ChunkStore(chunk_store_path)
+        # Lexical index over the same chunk IDs, for exact terms embeddings miss
+        self.bm25 = BM25Index()
+        # float32 vectors by chunk ID, only kept while the index is compressed
+        self.vector_store = VectorStore(
+            vectors_path or os.path.join(os.path.dirname(index_path), "vectors.f32")
+        )
+        self._exact_vectors = False
 
-    def _load_or_prepare_chunks(self):
+        # Per-file content hash and chunk-ID range [start_id, end_id)
+        self.manifest = {"next_id": 0, "files": {}}
+        self.index = None
+        self._index_mapped = False
+
+        if read_only:
+            self._load_state(strict=True)
+            return
+
+        # Load what was persisted, then re-embed only documents that changed
+        self._load_state()
+        self.update_index()
+        if self._convert_index_type() or (self.index is not None and "artifact" not in self.manifest):
+            self._save_state()
+
+    @property
+    def index_version(self):
+        """Fingerprint of the indexed corpus; changes whenever any document does"""
+        h = hashlib.sha256()
+        for path, entry in sorted(self.manifest["files"].items()):
+            h.update(f"{path}:{entry['hash']}\n".encode("utf-8"))
+        return h.hexdigest()
+
+    def _load_state(self, strict=False):
         """
-        Load chunk text and sources from disk if available; otherwise build them
-        from documents and persist for future runs.
+        Load the manifest, chunk store and FAISS index (any type from
+        index_factory; all of them are keyed by chunk ID). If anything is
+        missing, inconsistent (e.g. a crash between writing the chunk store
+        and the index), built with another embedding model or in the old
+        (pre-manifest) format, the state is reset so that update_index()
+        rebuilds everything.
+
+        With strict=True nothing is reset or written: problems raise
+        IndexMismatchError instead.
         """
-        if os.path.exists(self.chunks_path):
-            try:
-                with open(self.chunks_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                return data["all_chunks"], data["chunk_sources"]
-            except Exception:
-                # Fall back to rebuilding if cached chunks cannot be loaded
-                pass
-
-        all_chunks, chunk_sources = get_chunks(self.folder)
-        self._save_chunks(all_chunks, chunk_sources)
-        return all_chunks, chunk_sources
-
-    def _save_chunks(self, all_chunks, chunk_sources):
-        directory = os.path.dirname(self.chunks_path)
-        if directory:
-            os.makedirs(directory, exist_ok=True)
-        with open(self.chunks_path, "w", encoding="utf-8") as f:
-            json.dump(
-                {"all_chunks": all_chunks, "chunk_sources": chunk_sources},
-                f,
-                ensure_ascii=False,
-            )
+        if not os.path.exists(self.index_path) or not os.path.exists(self.manifest_path):
+            if strict:
+                raise IndexMismatchError(f"No index artifacts at {self.manifest_path}, run build_index.py first")
+            self._clear_stores()
+            return
+
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if not strict and not ChunkStore.exists(self.chunk_store.directory):
+                self._migrate_json_chunks()
+            index = self._read_index()
+        except Exception as e:
+            if strict:
+                raise IndexMismatchError(f"Cannot load index artifacts: {e}")
+            # Fall back to rebuilding if anything goes wrong while loading
+            self._clear_stores()
+            return
+
+        if not strict:
+            # Chunks stored after the last checkpoint of an interrupted import
+            ids = self.chunk_store.ids()
+            self.chunk_store.delete(ids[ids >= manifest["next_id"]])
+
+        problems = self._check_artifact(manifest, index)
+        if problems:
+            if strict:
+                raise IndexMismatchError("; ".join(problems))
+            print(f"Rebuilding index: {'; '.join(problems)}")
+            self._clear_stores()
+            return
 
-    def _load_or_build_index(self):
+        self.manifest = manifest
+        self.index = index
+        set_search_params(self.index, ef_search=self.ef_search, nprobe=self.nprobe)
+        self._load_bm25(save=not strict)
+        self._exact_vectors = self._compressed() and self.vector_store.covers(self.chunk_store.ids())
+
+    def _clear_stores(self):
+        self.chunk_store.clear()
+        delete_bm25(self.bm25_path)
+        self.bm25 = BM25Index()
+        # Only delete vectors this instance uses. A leftover file is harmless:
+        # it is only trusted for an index converted over it (clear + put in
+        # _rebuild_index)
+        if self._exact_vectors:
+            self.vector_store.clear()
+        self._exact_vectors = False
+
+    def _compressed(self):
+        """Whether the index only holds approximations of the vectors"""
+        return self.index is not None and (
+            compression_of(self.index) is not None or index_type_of(self.index) == "ivfpq"
+        )
+
+    def _check_artifact(self, manifest, index):
         """
-        Try loading a persisted FAISS index; if unavailable or out of date,
-        rebuild and save a fresh one.
+        Compare loaded artifacts with this RAG's settings.
+
+        Returns:
+            List of human-readable problems (empty if the artifacts are usable)
         """
-        if os.path.exists(self.index_path):
-            try:
-                index = faiss.read_index(self.index_path)
+        problems = []
+        if index.ntotal != len(self.chunk_store):
+            problems.append(f"index has {index.ntotal} vectors but chunk store has {len(self.chunk_store)} chunks")
 
-                # If the number of embeddings matches our current chunks, reuse the index
-                if index.ntotal == len(self.all_chunks):
-                    return index
-            except Exception:
-                # Fall back to rebuilding the index if anything goes wrong while loading
-                pass
+        artifact = manifest.get("artifact")
+        if artifact is None:
+            # Written before artifacts were versioned; fine to update in place
+            if self.read_only:
+                problems.append("manifest has no artifact header, rebuild with build_index.py")
+            return problems
 
-        index = self._build_index()
-        self._save_index(index)
-        return index
+        if artifact.get("format") != ARTIFACT_FORMAT:
+            problems.append(f"artifact format {artifact.get('format')}, expected {ARTIFACT_FORMAT}")
+        if artifact.get("embed_model") != self.embed_model:
+            problems.append(f"built with embedding model {artifact.get('embed_model')}, configured {self.embed_model}")
+        if artifact.get("dim") != index.d:
+            problems.append(f"artifact says dimension {artifact.get('dim')}, index has {index.d}")
+        if self.read_only:
+            # A writable RAG re-chunks on its own (see _diff_documents)
+            if artifact.get("chunker") != self._chunker_config():
+                problems.append(f"built with chunker {artifact.get('chunker')}, configured {self._chunker_config()}")
+            if manifest.get("pending"):
+                problems.append(f"build of {manifest['pending']['path']} did not finish")
+        return problems
 
-    def _save_index(self, index):
+    def artifact_info(self):
+        """Metadata written next to the index, identifying how it was built"""
+        return {
+            "format": ARTIFACT_FORMAT,
+            "embed_model": self.embed_model,
+            "dim": self.index.d if self.index is not None else None,
+            "chunker": self._chunker_config(),
+            "index_type": index_type_of(self.index) if self.index is not None else None,
+            "compression": compression_of(self.index) if self.index is not None else None,
+            "corpus_hash": self.index_version,
+            "documents": len(self.manifest["files"]),
+            "chunks": self.index.ntotal if self.index is not None else 0,
+            "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+    def _load_bm25(self, save=True):
+        """Map the BM25 index, or rebuild it from the chunk store (no embedding needed)"""
+        try:
+            self.bm25 = MappedBM25Index(self.bm25_path)
+            # Chunk ids are never reused, so the same ids means the same chunks
+            if np.array_equal(self.bm25.ids(), self.chunk_store.ids()):
+                return
+        except Exception:
+            pass
+
+        print("Rebuilding BM25 index from the chunk store")
+        ids = self.chunk_store.ids().tolist()
+        self.bm25 = BM25Index()
+        self.bm25.add(ids, (self.chunk_store.get(i)["chunk"] for i in ids))
+        if save:
+            self.bm25.save(self.bm25_path)
+            self.bm25 = MappedBM25Index(self.bm25_path)
+
+    def _read_index(self):
+        # Mapped read-only: the OS page cache holds a single copy for all workers
+        self._index_mapped = self.mmap_index
+        if self.mmap_index:
+            return faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        return faiss.read_index(self.index_path)
+
+    def _ensure_writable(self):
+        """A memory-mapped index is read-only: load a private copy before modifying it"""
+        if self.index is not None and self._index_mapped:
+            self.index = faiss.read_index(self.index_path)
+            self._index_mapped = False
+            set_search_params(self.index, ef_search=self.ef_search, nprobe=self.nprobe)
+        if isinstance(self.bm25, MappedBM25Index):
+            self.bm25 = BM25Index.load(self.bm25_path)
+
+    def _migrate_json_chunks(self):
+        """Import chunks from the old faiss_chunks.json into the chunk store"""
+        with open(self.chunks_path, "r", encoding="utf-8") as f:
+            chunks = json.load(f)["chunks"]
+
+        ids = sorted(int(chunk_id) for chunk_id in chunks)
+        self.chunk_store.append(
+            ids,
+            [chunks[str(i)]["chunk"] for i in ids],
+            [chunks[str(i)]["source"] for i in ids],
+        )
+        print(f"Migrated {len(ids)} chunks from {self.chunks_path} to {self.chunk_store.directory}")
+
+    def _save_state(self, bm25=True):
+        """
+        Args:
+            bm25: Also write the BM25 index. Ingest checkpoints skip it: a
+                full rewrite per checkpoint is slow, and after an
+                interruption _load_bm25 rebuilds it from the chunk store
+        """
         directory = os.path.dirname(self.index_path)
         if directory:
             os.makedirs(directory, exist_ok=True)
-        faiss.write_index(index, self.index_path)
 
-    # Build FAISS index from all chunk embeddings
-    def _build_index(self):
-        vectors = []
+        # Write to temp files and swap in, so a crash never leaves a half-written
+        # index next to a manifest that claims it is complete. The chunk store
+        # persists itself as it is modified.
+        if self.read_only:
+            raise RuntimeError("RAG was opened read-only")
+        self.manifest["artifact"] = self.artifact_info()
+
+        faiss.write_index(self.index, self.index_path + ".tmp")
+        _write_json(self.manifest_path + ".tmp", self.manifest)
+
+        os.replace(self.index_path + ".tmp", self.index_path)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
 
-        # Embed in batches (faster, avoids token overuse)
-        for i in range(0, len(self.all_chunks), self.batch_size):
-            batch = self.all_chunks[i:i + self.batch_size]
-            vectors.append(embed_batch_ollama(batch))
+        # A mapped BM25 index has not been modified since it was written
+        if bm25 and isinstance(self.bm25, BM25Index):
+            self.bm25.save(self.bm25_path)
+            self.bm25 = MappedBM25Index(self.bm25_path)
 
-        embeddings = np.vstack(vectors)
+        # Serve from the mapped file again instead of the private copy
+        if self.mmap_index:
+            self.index = self._read_index()
+            set_search_params(self.index, ef_search=self.ef_search, nprobe=self.nprobe)
 
-        # Store embeddings for retrieval
-        self.embeddings = embeddings
+    def _diff_documents(self):
+        """
+        Compare documents on disk against the manifest.
+
+        Returns:
+            (changed, removed, hashes): paths to (re-)embed, paths to drop, and
+            the current content hash of every document on disk
+        """
+        hashes = {path: file_content_hash(path) for path in list_document_files(self.folder)}
+        known = self.manifest["files"]
 
-        # Create FAISS index
-        dim = embeddings.shape[1]
-        index = faiss.IndexFlatL2(dim)
-        index.add(embeddings)
+        # Chunks made with other chunker settings are all redone
+        if self.manifest.get("chunker") != self._chunker_config():
+            return list(hashes), [p for p in known if p not in hashes], hashes
 
-        return index
+        changed = [p for p, h in hashes.items() if known.get(p, {}).get("hash") != h]
+        removed = [p for p in known if p not in hashes]
+        return changed, removed, hashes
+
+    def stale_documents(self):
+        """
+        Returns:
+            (changed, removed): documents on disk that differ from the index
+        """
+        changed, removed, _ = self._diff_documents()
+        return changed, removed
+
+    def _chunker_config(self):
+        if self.chunker == "fixed":
+            return {"name": "fixed"}
+        # version 2: sentence splits keep their whitespace
+        return {"name": self.chunker, "max_tokens": self.chunk_tokens, "version": 2}
+
+    def _chunk_document(self, path):
+        """Returns: (chunk texts, chunk metadata)"""
+        if self.chunker == "fixed":
+            chunks = chunk_text(load_text_file(path))
+            return chunks, [None] * len(chunks)
+        chunks = chunk_document(path, max_tokens=self.chunk_tokens)
+        return [c["text"] for c in chunks], [c["meta"] for c in chunks]
+
+    def update_index(self):
+        """
+        Re-embed only the documents that were added, changed or deleted since
+        the manifest was written.
+
+        Returns:
+            True if the index was modified, False if it was already up to date
+        """
+        if self.read_only:
+            raise RuntimeError("RAG was opened read-only")
+
+        changed, removed, hashes = self._diff_documents()
+        pending = self.manifest.get("pending")
+        if not changed and not removed and not pending:
+            return False
+
+        print(f"Updating index: {len(changed)} new/changed, {len(removed)} removed document(s)")
+        self._ensure_writable()
+
+        if pending:
+            if (
+                hashes.get(pending["path"]) == pending["hash"]
+                and self.manifest.get("chunker") == self._chunker_config()
+            ):
+                # Resume the interrupted document first, so its IDs stay contiguous
+                print(f"Resuming {pending['path']} after {pending['done']} chunk(s)")
+                changed.remove(pending["path"])
+                changed.insert(0, pending["path"])
+            else:
+                start_id = pending["start_id"]
+                self._remove_ids(np.arange(start_id, start_id + pending["done"], dtype="int64"))
+                self.manifest["pending"] = None
+
+        # Drop old chunks of changed and deleted documents
+        for path in changed + removed:
+            if path in self.manifest["files"]:
+                self._remove_document(path)
+        self.manifest["chunker"] = self._chunker_config()
+
+        try:
+            self._ingest(changed, hashes)
+        except Exception:
+            # Keep what was embedded so far; the next update resumes from here
+            if self.index is not None:
+                self._save_state(bm25=False)
+            print("Index update interrupted, progress saved")
+            raise
+
+        if self.index is not None:
+            self._convert_index_type()
+            self._save_state()
+        return True
+
+    def _iter_documents(self, paths):
+        """Yield (path, chunk texts, chunk metadata), one document in memory at a time"""
+        for path in paths:
+            texts, metas = self._chunk_document(path)
+            yield path, texts, metas
+
+    def _ingest(self, paths, hashes):
+        """
+        Streaming ingestion: chunks flow through in windows of
+        batch_size * max_workers (one embedding request per worker), and each
+        window is embedded, added to the index, the chunk store and BM25
+        before the next one is read. Memory use does not grow with the corpus.
+
+        The state is checkpointed every checkpoint_every chunks. manifest
+        ["pending"] records how far the current document got, so an
+        interrupted import (e.g. Ollama going away) resumes mid-document.
+        BM25 is only written once the import finishes.
+        """
+        window_size = self.batch_size * self.max_workers
+        window = []
+        finished = []
+        since_checkpoint = 0
+        total = 0
+
+        def flush(pending):
+            nonlocal since_checkpoint, total
+            if window:
+                # IDs are only consumed once the window made it into the index
+                start = self.manifest["next_id"]
+                self._add_chunks(range(start, start + len(window)), window)
+                self.manifest["next_id"] = start + len(window)
+                since_checkpoint += len(window)
+                total += len(window)
+                print(f"Indexed {total} chunk(s)")
+            for path, entry in finished:
+                self.manifest["files"][path] = entry
+            self.manifest["pending"] = pending
+            window.clear()
+            finished.clear()
+            if since_checkpoint >= self.checkpoint_every:
+                self._save_state(bm25=False)
+                since_checkpoint = 0
+
+        pending = self.manifest.get("pending")
+        for path, texts, metas in self._iter_documents(paths):
+            done = 0
+            if pending and pending["path"] == path:
+                done = pending["done"]
+                start_id = pending["start_id"]
+            else:
+                start_id = self.manifest["next_id"] + len(window)
+            entry = {
+                "hash": hashes[path],
+                "start_id": start_id,
+                "end_id": start_id + len(texts),
+            }
+
+            if done == len(texts):
+                finished.append((path, entry))
+                continue
+
+            for position in range(done, len(texts)):
+                window.append((path, texts[position], metas[position]))
+
+                last = position == len(texts) - 1
+                if last:
+                    finished.append((path, entry))
+                if len(window) >= window_size:
+                    flush(None if last else {
+                        "path": path,
+                        "hash": hashes[path],
+                        "start_id": start_id,
+                        "done": position + 1,
+                    })
+
+        flush(None)
+
+    def _add_chunks(self, ids, window):
+        """Embed one window of (source, text, meta) and add it everywhere under ids"""
+        ids = list(ids)
+        texts = [text for _, text, _ in window]
+
+        # Embed in batches through /api/embed, several batches in flight at once
+        embeddings = embed_batches_concurrent(
+            texts,
+            batch_size=self.batch_size,
+            max_workers=self.max_workers,
+            model=self.embed_model,
+            progress=False,
+        )
+        if self.index is None:
+            # IVF-PQ needs the whole corpus to train: start flat and let
+            # _convert_index_type() rebuild once everything is in
+            first_type = "hnsw" if self.index_type == "hnsw" else "flat"
+            self.index, _ = build_index(embeddings, ids, first_type, **self.index_params)
+            set_search_params(self.index, ef_search=self.ef_search, nprobe=self.nprobe)
+        else:
+            self.index.add_with_ids(embeddings, np.array(ids, dtype="int64"))
+        if self._exact_vectors:
+            self.vector_store.put(ids, embeddings)
+
+        self.chunk_store.append(
+            ids,
+            texts,
+            [source for source, _, _ in window],
+            [meta for _, _, meta in window],
+        )
+        self.bm25.add(ids, texts)
+
+    def _target_index_type(self):
+        return resolve_index_type(self.index_type, self.index.ntotal)
+
+    def _target_compression(self, index_type):
+        # IVF-PQ has its own compression
+        return None if index_type == "ivfpq" else self.compression
+
+    def _convert_index_type(self):
+        """
+        Rebuild the index from its stored vectors (no re-embedding) when it is
+        not of the configured type, e.g. after changing index_type or when
+        "auto" picks a different type because the corpus grew.
+
+        Returns:
+            True if the index was rebuilt
+        """
+        if self.index is None:
+            return False
+        target = self._target_index_type()
+        current = (index_type_of(self.index), compression_of(self.index))
+        if current == (target, self._target_compression(target)):
+            return False
+
+        print(f"Converting index from {current} to {(target, self._target_compression(target))}")
+        self._rebuild_index(self.chunk_store.ids(), target)
+        return True
+
+    def _vectors(self, ids):
+        """Full-precision vectors when stored, else the index's reconstruction"""
+        if self._exact_vectors:
+            return self.vector_store.get(ids)
+        return reconstruct_all(self.index, ids)
+
+    def _rebuild_index(self, ids, index_type):
+        vectors = self._vectors(ids)
+        compressed_before = self._compressed()
+        self.index, _ = build_index(
+            vectors, ids, index_type, compression=self._target_compression(index_type), **self.index_params
+        )
+        self._index_mapped = False
+        set_search_params(self.index, ef_search=self.ef_search, nprobe=self.nprobe)
+
+        if not self._compressed():
+            self._exact_vectors = False
+        elif not self._exact_vectors:
+            # Coming from float32 the vectors are exact: keep them for re-scoring
+            if compressed_before:
+                print("No stored float32 vectors, re-scoring disabled until a full rebuild")
+            else:
+                self.vector_store.clear()
+                self.vector_store.put(ids, vectors)
+                self._exact_vectors = True
+
+    def _remove_document(self, path):
+        entry = self.manifest["files"].pop(path)
+        self._remove_ids(np.arange(entry["start_id"], entry["end_id"], dtype="int64"))
+
+    def _remove_ids(self, ids):
+        if self.index is not None and len(ids):
+            try:
+                self.index.remove_ids(ids)
+            except RuntimeError:
+                # HNSW cannot delete vectors: rebuild it from the ones we keep
+                all_ids = self.chunk_store.ids()
+                remaining = all_ids[~np.isin(all_ids, ids)]
+                self._rebuild_index(remaining, index_type_of(self.index))
+        self.chunk_store.delete(ids)
+        self.bm25.remove(ids.tolist())
+
+    def embed_query(self, query):
+        """Query vector of shape (1, dim), served from the query cache when possible"""
+        return self.query_cache.get_or_embed(
+            self.embed_model,
+            query,
+            lambda texts: embed_batch_ollama(texts, model=self.embed_model),
+        )
 
     # Retrives nearest chunks
     def retrieve(self, query, k=3):
-        q_vec = embed_batch_ollama([query])
+        """
+        Returns:
+            Up to k chunks ({"id", "chunk", "source", "meta", "score"}), best
+            first; meta holds the heading path for markdown chunks.
+            With hybrid retrieval, score is the fused RRF score; otherwise it
+            is the vector distance. With a reranker, results also carry
+            "similarity" and "ids" (adjacent chunks may be merged into one).
+        """
+        if self.index is None or self.index.ntotal == 0:
+            return []
+
+        with stage("embed_query"):
+            q_vec = self.embed_query(query)
+        n = max(k, self.reranker.fetch_k) if self.reranker else k
 
-        distances, idxs = self.index.search(q_vec, k)
+        if not self.hybrid:
+            ranked = self._vector_search(q_vec, n)
+        else:
+            dense = [i for i, _ in self._vector_search(q_vec, max(n, self.candidates))]
+            with stage("bm25_search"):
+                lexical = [chunk_id for chunk_id, _ in self.bm25.search(query, max(n, self.candidates))]
+            ranked = reciprocal_rank_fusion([dense, lexical], k=self.rrf_k)[:n]
 
         results = []
-        for idx in idxs[0]:
+        for idx, score in ranked:
+            item = self.chunk_store.get(idx)
             results.append({
-                "chunk": self.all_chunks[idx],
-                "source": self.chunk_sources[idx]
+                "id": idx,
+                "chunk": item["chunk"],
+                "source": item["source"],
+                "meta": item["meta"],
+                "score": score,
             })
+
+        if self.reranker:
+            with stage("rerank"):
+                vectors = self._vectors([r["id"] for r in results])
+                relevance = None
+                if self.hybrid and results:
+                    # Fused scores, scaled so the top candidate has relevance 1
+                    relevance = [r["score"] / results[0]["score"] for r in results]
+                return self.reranker.rerank(query, q_vec, results, vectors, k, relevance=relevance)
         return results
+
+    def _vector_search(self, q_vec, n):
+        """[(id, L2 distance)] of the n nearest chunks, nearest first"""
+        rescore = self.rescore and self._exact_vectors
+        with stage("vector_search"):
+            # Compressed distances are approximate: take more, keep the truly closest
+            distances, idxs = self.index.search(q_vec, n * self.rescore if rescore else n)
+        # FAISS pads with -1 when there are fewer than n vectors
+        ranked = [(int(i), float(d)) for i, d in zip(idxs[0], distances[0]) if i >= 0]
+        if not rescore:
+            return ranked
+
+        with stage("rescore"):
+            ids = [i for i, _ in ranked]
+            ids, distances = exact_rescore(q_vec, ids, self.vector_store.get(ids), n)
+        return list(zip(ids, distances))
+
+
+def _write_json(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
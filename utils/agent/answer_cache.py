@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    def __init__(self, threshold=0.95, ttl=3600, max_entries=512):
+        """
+        Reuse generated answers for near-duplicate first-turn questions
+
+        An answer is reused when the new query embedding has cosine similarity
+        >= threshold with a cached one, the same model is asked and RAG
+        retrieved the same chunk IDs for both.
+
+        Args:
+            threshold: Minimum cosine similarity to count as the same question
+            ttl: Seconds an answer stays valid
+            max_entries: Maximum number of cached answers (LRU eviction)
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()
+        self._next_key = 0
+        self._index_version = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self, index_version):
+        # Answers were generated from the old documents, so drop them all
+        if index_version != self._index_version:
+            self._entries.clear()
+            self._index_version = index_version
+
+    def _expire(self, now):
+        expired = [k for k, e in self._entries.items() if now - e["created"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, query_vec, chunk_ids, model, index_version=None):
+        """
+        Returns:
+            Cached answer string, or None on a miss
+        """
+        query_vec = _unit(query_vec)
+        chunk_ids = frozenset(chunk_ids)
+
+        with self._lock:
+            self._check_version(index_version)
+            self._expire(time.time())
+
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if entry["model"] == model and entry["chunk_ids"] == chunk_ids
+            ]
+            if candidates:
+                vectors = np.vstack([entry["vector"] for _, entry in candidates])
+                scores = vectors @ query_vec
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key, entry = candidates[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry["answer"]
+
+            self.misses += 1
+            return None
+
+    def store(self, query_vec, chunk_ids, model, answer, index_version=None):
+        with self._lock:
+            self._check_version(index_version)
+
+            self._entries[self._next_key] = {
+                "vector": _unit(query_vec),
+                "chunk_ids": frozenset(chunk_ids),
+                "model": model,
+                "answer": answer,
+                "created": time.time(),
+            }
+            self._next_key += 1
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype="float32").reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
@@ -0,0 +1,309 @@
+import hashlib
+import json
+import math
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+
+# Runs of CJK ideographs, or runs of latin letters/digits (after NFKC, so
+# full-width letters and digits are plain ASCII)
+_TOKEN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z0-9]+")
+
+BM25_VERSION = 2
+
+# Compiled on-disk format (see BM25Index.save), memory-mapped by MappedBM25Index:
+# one record per term sorted by term hash, pointing at its postings
+TERM_DTYPE = np.dtype([
+    ("hash", "<u8"),
+    ("offset", "<i8"),   # first posting of the term
+    ("count", "<i4"),    # number of postings (document frequency)
+])
+# Postings of each term back to back, sorted by chunk id within a term
+POSTING_DTYPE = np.dtype([("id", "<i8"), ("tf", "<i4")])
+# Number of terms per chunk, sorted by chunk id
+DOC_DTYPE = np.dtype([("id", "<i8"), ("length", "<i4")])
+
+
+def tokenize(text):
+    """
+    Terms for lexical search: overlapping character bigrams for Chinese
+    (there are no spaces to split words on, and most words are two or more
+    characters) and lowercased words for everything else.
+
+    "病人自主權利法" -> ["病人", "人自", "自主", "主權", "權利", "利法"]
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    terms = []
+    for run in _TOKEN_RE.findall(text):
+        if run.isascii() or len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def term_hash(term):
+    """64-bit term key; a collision would only merge two terms' postings lookups"""
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _bm25_meta_path(directory):
+    return os.path.join(directory, "bm25.json")
+
+
+def _read_bm25_meta(directory):
+    with open(_bm25_meta_path(directory), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("version") != BM25_VERSION:
+        raise ValueError(f"Unsupported BM25 index version {meta.get('version')} in {directory}")
+    return meta
+
+
+def _map_array(path, dtype):
+    n = os.path.getsize(path) // dtype.itemsize
+    return np.memmap(path, dtype=dtype, mode="r", shape=(n,)) if n else np.zeros(0, dtype=dtype)
+
+
+def delete_bm25(directory):
+    """Remove a saved BM25 index"""
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name == "bm25.json" or name.startswith(("terms.", "postings.", "docs.")):
+            os.remove(os.path.join(directory, name))
+
+
+class BM25Index:
+    """
+    Inverted index with Okapi BM25 scoring, keyed by the same chunk IDs as
+    the FAISS index so both can be updated together and their results fused.
+
+    This is the in-memory, updatable form used while the index changes;
+    save() compiles it to flat files that MappedBM25Index serves from
+    without loading them into the heap.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+        # term -> {chunk_id: term frequency}
+        self.postings = {}
+        # chunk_id -> number of terms in the chunk
+        self.doc_len = {}
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def ids(self):
+        """Sorted chunk ids"""
+        return np.array(sorted(self.doc_len), dtype="int64")
+
+    def add(self, ids, texts):
+        for chunk_id, text in zip(ids, texts):
+            chunk_id = int(chunk_id)
+            terms = tokenize(text)
+            for term in terms:
+                docs = self.postings.setdefault(term, {})
+                docs[chunk_id] = docs.get(chunk_id, 0) + 1
+            self.doc_len[chunk_id] = len(terms)
+            self.total_len += len(terms)
+
+    def remove(self, ids):
+        ids = {int(i) for i in ids} & self.doc_len.keys()
+        if not ids:
+            return
+
+        # Removals only happen when a document changes, so scanning the
+        # vocabulary is cheaper than keeping a forward index in memory
+        for term in list(self.postings):
+            docs = self.postings[term]
+            for chunk_id in ids & docs.keys():
+                del docs[chunk_id]
+            if not docs:
+                del self.postings[term]
+        for chunk_id in ids:
+            self.total_len -= self.doc_len.pop(chunk_id)
+
+    def search(self, query, k=10):
+        """
+        Returns:
+            Up to k (chunk_id, score) pairs, best first
+        """
+        if not self.doc_len:
+            return []
+
+        n = len(self.doc_len)
+        avg_len = self.total_len / n or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for chunk_id, tf in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[chunk_id] / avg_len)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def save(self, directory):
+        """
+        Compile to directory:
+
+        - terms.<gen>.bin: TERM_DTYPE records sorted by term hash
+        - terms.<gen>.txt: the terms in the same order, one per line (only
+          read by load(), to make the index updatable again)
+        - postings.<gen>.bin, docs.<gen>.bin: POSTING_DTYPE / DOC_DTYPE
+        - bm25.json: parameters and the names of the current files
+
+        A save writes a new generation and switches to it by replacing
+        bm25.json, so processes that mapped the previous files keep a
+        consistent view.
+        """
+        if os.path.isfile(directory):
+            # Single JSON file of the old format
+            os.remove(directory)
+        os.makedirs(directory, exist_ok=True)
+        try:
+            generation = _read_bm25_meta(directory)["generation"] + 1
+        except (OSError, ValueError, KeyError):
+            generation = 0
+        names = {kind: f"{kind}.{generation}.bin" for kind in ("terms", "postings", "docs")}
+        names["words"] = f"terms.{generation}.txt"
+
+        keyed = sorted((term_hash(term), term) for term in self.postings)
+        terms = np.zeros(len(keyed), dtype=TERM_DTYPE)
+        offset = 0
+        with open(os.path.join(directory, names["postings"]), "wb") as f:
+            for i, (key, term) in enumerate(keyed):
+                docs = self.postings[term]
+                postings = np.array(sorted(docs.items()), dtype="int64").reshape(-1, 2)
+                records = np.zeros(len(docs), dtype=POSTING_DTYPE)
+                records["id"], records["tf"] = postings[:, 0], postings[:, 1]
+                f.write(records.tobytes())
+                terms[i] = (key, offset, len(docs))
+                offset += len(docs)
+        with open(os.path.join(directory, names["terms"]), "wb") as f:
+            f.write(terms.tobytes())
+        with open(os.path.join(directory, names["words"]), "w", encoding="utf-8") as f:
+            f.write("\n".join(term for _, term in keyed))
+
+        docs = np.zeros(len(self.doc_len), dtype=DOC_DTYPE)
+        docs["id"] = self.ids()
+        docs["length"] = [self.doc_len[int(chunk_id)] for chunk_id in docs["id"]]
+        with open(os.path.join(directory, names["docs"]), "wb") as f:
+            f.write(docs.tobytes())
+
+        # Commit point
+        meta_path = _bm25_meta_path(directory)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": BM25_VERSION,
+                    "generation": generation,
+                    "k1": self.k1,
+                    "b": self.b,
+                    "total_len": self.total_len,
+                    "files": names,
+                },
+                f,
+            )
+        os.replace(meta_path + ".tmp", meta_path)
+
+        current = set(names.values())
+        for name in os.listdir(directory):
+            if name.startswith(("terms.", "postings.", "docs.")) and name not in current:
+                os.remove(os.path.join(directory, name))
+
+    @classmethod
+    def load(cls, directory):
+        """Read a saved index back into memory, to update it"""
+        mapped = MappedBM25Index(directory)
+        index = cls(k1=mapped.k1, b=mapped.b)
+        with open(os.path.join(directory, mapped.files["words"]), "r", encoding="utf-8") as f:
+            words = f.read().split("\n") if len(mapped.terms) else []
+
+        for term, record in zip(words, mapped.terms):
+            start, count = int(record["offset"]), int(record["count"])
+            postings = mapped.postings[start:start + count]
+            index.postings[term] = dict(zip(postings["id"].tolist(), postings["tf"].tolist()))
+        index.doc_len = dict(zip(mapped.docs["id"].tolist(), mapped.docs["length"].tolist()))
+        index.total_len = sum(index.doc_len.values())
+        return index
+
+
+class MappedBM25Index:
+    """
+    Read-only BM25 index served straight from the files BM25Index.save()
+    wrote. Opening it maps three files and reads a small JSON, whatever the
+    corpus size, and every worker process shares the same page cache.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        meta = _read_bm25_meta(directory)
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+        self.total_len = meta["total_len"]
+        self.files = meta["files"]
+
+        self.terms = _map_array(os.path.join(directory, self.files["terms"]), TERM_DTYPE)
+        self.postings = _map_array(os.path.join(directory, self.files["postings"]), POSTING_DTYPE)
+        self.docs = _map_array(os.path.join(directory, self.files["docs"]), DOC_DTYPE)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def ids(self):
+        return np.array(self.docs["id"])
+
+    def search(self, query, k=10):
+        """Same scores as BM25Index.search"""
+        n = len(self.docs)
+        if not n:
+            return []
+
+        avg_len = self.total_len / n or 1.0
+        hashes = self.terms["hash"]
+        doc_ids, doc_scores = [], []
+        for term in set(tokenize(query)):
+            key = term_hash(term)
+            pos = int(np.searchsorted(hashes, key))
+            if pos == len(hashes) or int(hashes[pos]) != key:
+                continue
+            start, count = int(self.terms["offset"][pos]), int(self.terms["count"][pos])
+            postings = self.postings[start:start + count]
+
+            idf = math.log(1 + (n - count + 0.5) / (count + 0.5))
+            tf = postings["tf"].astype("float64")
+            lengths = self.docs["length"][np.searchsorted(self.docs["id"], postings["id"])]
+            norm = self.k1 * (1 - self.b + self.b * lengths / avg_len)
+            doc_ids.append(postings["id"])
+            doc_scores.append(idf * tf * (self.k1 + 1) / (tf + norm))
+
+        if not doc_ids:
+            return []
+        ids, inverse = np.unique(np.concatenate(doc_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(doc_scores))
+        best = np.argsort(-scores, kind="stable")[:k]
+        return [(int(ids[i]), float(scores[i])) for i in best]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Merge several ranked lists of chunk IDs: each list contributes
+    1 / (k + rank) to every ID it contains.
+
+    Returns:
+        (chunk_id, score) pairs, best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
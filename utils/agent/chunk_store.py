@@ -0,0 +1,240 @@
+import json
+import mmap
+import os
+
+import numpy as np
+
+
+# One fixed-size record per chunk in the .idx file, sorted by chunk id
+RECORD_DTYPE = np.dtype([
+    ("id", "<i8"),
+    ("offset", "<i8"),   # byte offset of the UTF-8 text in the .bin file
+    ("length", "<i4"),   # byte length of the text
+    ("source", "<i4"),   # index into the interned "sources" table
+    ("meta", "<i4"),     # index into the interned "metas" table (-1 = none)
+])
+
+STORE_VERSION = 1
+
+
+class ChunkStore:
+    """
+    Compact on-disk chunk store shared between processes through mmap:
+
+    - chunks.<gen>.bin: UTF-8 chunk texts, back to back
+    - chunks.<gen>.idx: RECORD_DTYPE records sorted by id (lookups are a
+      binary search over the memory-mapped id column)
+    - chunks.json: names of the current .bin/.idx files plus the interned
+      source paths and metadata strings
+
+    Records are appended in increasing id order. Deletions write a new .idx
+    file (and a compacted .bin once half of it is garbage) and switch to them
+    by replacing chunks.json, so the switch is atomic and processes that
+    already mapped the old files keep a consistent view.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, "chunks.json")
+
+        self.generation = 0
+        self.bin_name = "chunks.0.bin"
+        self.idx_name = "chunks.0.idx"
+        self.sources = []
+        self.metas = []
+        self._source_ids = {}
+        self._meta_ids = {}
+
+        self._records = np.zeros(0, dtype=RECORD_DTYPE)
+        self._blob = b""
+        self._blob_file = None
+        self._open()
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, "chunks.json"))
+
+    def _open(self):
+        if not os.path.exists(self.meta_path):
+            return
+
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported chunk store version {meta.get('version')} in {self.directory}")
+
+        self.generation = meta["generation"]
+        self.bin_name = meta["bin"]
+        self.idx_name = meta["idx"]
+        self.sources = meta["sources"]
+        self.metas = meta["metas"]
+        self._source_ids = {s: i for i, s in enumerate(self.sources)}
+        self._meta_ids = {m: i for i, m in enumerate(self.metas)}
+        self._map()
+
+    @property
+    def bin_path(self):
+        return os.path.join(self.directory, self.bin_name)
+
+    @property
+    def idx_path(self):
+        return os.path.join(self.directory, self.idx_name)
+
+    def _map(self):
+        """(Re)map both files; pages are shared with every other process mapping them"""
+        if self._blob_file is not None:
+            self._blob_file.close()
+            self._blob_file = None
+
+        n = os.path.getsize(self.idx_path) // RECORD_DTYPE.itemsize if os.path.exists(self.idx_path) else 0
+        self._records = (
+            np.memmap(self.idx_path, dtype=RECORD_DTYPE, mode="r", shape=(n,))
+            if n else np.zeros(0, dtype=RECORD_DTYPE)
+        )
+
+        self._blob = b""
+        if os.path.exists(self.bin_path) and os.path.getsize(self.bin_path):
+            self._blob_file = open(self.bin_path, "rb")
+            self._blob = mmap.mmap(self._blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, chunk_id):
+        return self._position(chunk_id) is not None
+
+    def ids(self):
+        return np.array(self._records["id"])
+
+    def _position(self, chunk_id):
+        ids = self._records["id"]
+        pos = int(np.searchsorted(ids, chunk_id))
+        if pos < len(ids) and ids[pos] == chunk_id:
+            return pos
+        return None
+
+    def get(self, chunk_id):
+        """
+        Returns:
+            {"chunk", "source", "meta"} for chunk_id
+
+        Raises:
+            KeyError if the chunk is not in the store
+        """
+        pos = self._position(int(chunk_id))
+        if pos is None:
+            raise KeyError(chunk_id)
+
+        record = self._records[pos]
+        offset, length = int(record["offset"]), int(record["length"])
+        meta = int(record["meta"])
+        return {
+            "chunk": self._blob[offset:offset + length].decode("utf-8"),
+            "source": self.sources[int(record["source"])],
+            "meta": json.loads(self.metas[meta]) if meta >= 0 else None,
+        }
+
+    def _intern(self, table, lookup, value):
+        if value not in lookup:
+            lookup[value] = len(table)
+            table.append(value)
+        return lookup[value]
+
+    def append(self, ids, texts, sources, metas=None):
+        """Append chunks; ids must be larger than every id already stored"""
+        if not len(ids):
+            return
+        if len(self._records) and min(ids) <= int(self._records["id"][-1]):
+            raise ValueError("ChunkStore ids must be appended in increasing order")
+        os.makedirs(self.directory, exist_ok=True)
+
+        metas = metas or [None] * len(ids)
+        records = np.zeros(len(ids), dtype=RECORD_DTYPE)
+
+        # Text first, records last: a reader never sees a record whose text is missing
+        with open(self.bin_path, "ab") as f:
+            offset = f.tell()
+            for i, (chunk_id, text, source, meta) in enumerate(zip(ids, texts, sources, metas)):
+                data = text.encode("utf-8")
+                f.write(data)
+                records[i] = (
+                    chunk_id,
+                    offset,
+                    len(data),
+                    self._intern(self.sources, self._source_ids, source),
+                    -1 if meta is None else self._intern(
+                        self.metas, self._meta_ids, json.dumps(meta, ensure_ascii=False)
+                    ),
+                )
+                offset += len(data)
+
+        # Newly interned sources/metas must be on disk before records refer to them
+        self._write_meta()
+        with open(self.idx_path, "ab") as f:
+            f.write(records.tobytes())
+        self._map()
+
+    def delete(self, ids):
+        """Remove chunks by id (writes a new index file, compacts the text blob when worthwhile)"""
+        if not len(self._records) or not len(ids):
+            return
+
+        keep = ~np.isin(self._records["id"], np.asarray(list(ids), dtype="int64"))
+        if keep.all():
+            return
+        records = np.array(self._records[keep])
+        old_files = {self.bin_path, self.idx_path}
+
+        self.generation += 1
+        if int(records["length"].sum()) < len(self._blob) // 2:
+            records = self._compact_blob(records, f"chunks.{self.generation}.bin")
+
+        self.idx_name = f"chunks.{self.generation}.idx"
+        with open(self.idx_path, "wb") as f:
+            f.write(records.tobytes())
+
+        # Commit point: readers opening from now on see the new files
+        self._write_meta()
+        self._map()
+        for path in old_files - {self.bin_path, self.idx_path}:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _compact_blob(self, records, bin_name):
+        offset = 0
+        with open(os.path.join(self.directory, bin_name), "wb") as f:
+            for i in range(len(records)):
+                start, length = int(records["offset"][i]), int(records["length"][i])
+                f.write(self._blob[start:start + length])
+                records["offset"][i] = offset
+                offset += length
+
+        self.bin_name = bin_name
+        return records
+
+    def _write_meta(self):
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": STORE_VERSION,
+                    "generation": self.generation,
+                    "bin": self.bin_name,
+                    "idx": self.idx_name,
+                    "sources": self.sources,
+                    "metas": self.metas,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, self.meta_path)
+
+    def clear(self):
+        for path in (self.bin_path, self.idx_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.generation = 0
+        self.bin_name, self.idx_name = "chunks.0.bin", "chunks.0.idx"
+        self.sources, self.metas = [], []
+        self._source_ids, self._meta_ids = {}, {}
+        self._map()
@@ -1,30 +1,224 @@
 import os
-import json
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from utils.agent.memory_storage import (
+    STORAGE_BACKENDS,
+    safe_user_id,
+    read_text_history,
+    write_text_history,
+)
+
+
+def format_history(history: List[Dict], summary: str = "") -> str:
+    """
+    Format a list of exchanges (and an optional summary of older ones) for
+    inclusion in an LLM prompt
+    
+    Returns:
+        Formatted string of conversation history, empty if no history
+    """
+    if not history and not summary:
+        return ""
+    
+    formatted = "=== PREVIOUS CONVERSATION HISTORY ===\n"
+    formatted += "You have access to the following conversation history with this user.\n"
+    formatted += "Use this context to provide continuity and reference previous discussions when relevant.\n\n"
+
+    if summary:
+        formatted += f"Summary of earlier conversation:\n{summary}\n\n"
+    
+    for exchange in history:
+        formatted += format_exchange(exchange)
+    
+    formatted += "=== END OF CONVERSATION HISTORY ===\n\n"
+    return formatted
+
+
+def format_exchange(exchange: Dict) -> str:
+    return (
+        f"[{exchange['timestamp']}]\n"
+        f"User: {exchange['question']}\n"
+        f"You: {exchange['answer']}\n\n"
+    )
+
+
+class _UserState:
+    """Per-user lock and bookkeeping, kept only while something uses it"""
+
+    __slots__ = ("lock", "generation", "migrated", "__weakref__")
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # Times the history was cleared, so a summary computed before a
+        # clear is not written after it
+        self.generation = 0
+        # Old .txt history already checked for import
+        self.migrated = False
 
 
 class ConversationMemory:
-    def __init__(self, storage_dir="conversation_history", max_history=10):
+    def __init__(
+        self,
+        storage_dir="conversation_history",
+        max_history=10,
+        summarize_fn: Optional[Callable[[str, List[Dict]], str]] = None,
+        backend="text",
+        cache_size=256,
+        file_lock=False,
+    ):
         """
-        Initialize conversation memory with text file storage
+        Initialize conversation memory
         
         Args:
             storage_dir: Directory to store conversation history files
             max_history: Maximum number of Q&A exchanges to keep per user
+            summarize_fn: Enables compaction. Called as
+                summarize_fn(previous_summary, evicted_exchanges) in a
+                background thread whenever exchanges fall out of the
+                max_history window; returns the new running summary
+            backend: Storage backend, one of "text" (one rewritten .txt file
+                per user), "jsonl" (append-only log per user) or "sqlite"
+                (one WAL database). Existing .txt histories are imported into
+                the jsonl/sqlite backends on first access.
+            cache_size: Number of users whose window is kept in memory (LRU);
+                writes go through to the backend immediately
+            file_lock: Also take a per-user lock file, for deployments with
+                several worker processes sharing storage_dir. Cached windows
+                are then re-validated against the backend on every read.
         """
         self.storage_dir = storage_dir
         self.max_history = max_history
+        self.summarize_fn = summarize_fn
+        self.backend = backend
+
+        # One thread, so each user's summary updates are applied in order
+        self._summarizer = ThreadPoolExecutor(max_workers=1) if summarize_fn else None
         
         # Create directory if it doesn't exist
         if not os.path.exists(storage_dir):
             os.makedirs(storage_dir)
+
+        if backend not in STORAGE_BACKENDS:
+            raise ValueError(f"Unknown memory backend '{backend}', expected one of {list(STORAGE_BACKENDS)}")
+        self.storage = STORAGE_BACKENDS[backend](storage_dir, max_history)
+
+        if file_lock and fcntl is None:
+            raise RuntimeError("file_lock=True needs fcntl, which is not available on this platform")
+        self.cache_size = cache_size
+        self.file_lock = file_lock
+
+        # user_id -> {"history", "count", "version", "user"} for the hottest users
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # user_id -> _UserState. Cache entries, running calls and queued
+        # summaries hold a reference; once none do, the state goes away, so
+        # this is bounded like the cache instead of growing with every user
+        self._users = weakref.WeakValueDictionary()
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+
+    def _user(self, user_id: str) -> _UserState:
+        with self._cache_lock:
+            user = self._users.get(user_id)
+            if user is None:
+                user = self._users[user_id] = _UserState()
+            return user
+
+    @contextmanager
+    def _locked(self, user_id: str):
+        """Serialize all reads and writes of one user's history; yields its _UserState"""
+        user = self._user(user_id)
+
+        with user.lock:
+            if not self.file_lock:
+                yield user
+                return
+
+            lock_path = os.path.join(self.storage_dir, f"{safe_user_id(user_id)}.lock")
+            with open(lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield user
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self, user_id: str) -> Dict:
+        """Cached window of a user (call with the user's lock held)"""
+        with self._cache_lock:
+            entry = self._cache.get(user_id)
+            if entry is not None:
+                self._cache.move_to_end(user_id)
+
+        # Another process may have written since we cached it
+        if entry is not None and self.file_lock and entry["version"] != self.storage.version(user_id):
+            entry = None
+
+        if entry is not None:
+            self.cache_hits += 1
+            return entry
+
+        self.cache_misses += 1
+        self._migrate_text_history(user_id)
+        entry = {
+            "history": self.storage.tail(user_id, self.max_history),
+            "count": self.storage.count(user_id),
+            "version": self.storage.version(user_id) if self.file_lock else None,
+            "user": self._user(user_id),
+        }
+        self._remember(user_id, entry)
+        return entry
+
+    def _remember(self, user_id: str, entry: Dict) -> None:
+        with self._cache_lock:
+            self._cache[user_id] = entry
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self.cache_evictions += 1
+
+    def cache_stats(self) -> Dict:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "entries": len(self._cache),
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "evictions": self.cache_evictions,
+            "hit_rate": self.cache_hits / lookups if lookups else 0.0,
+        }
     
     def _get_user_file_path(self, user_id: str) -> str:
-        """Get the file path for a user's conversation history"""
-        # Sanitize user_id to be safe for filenames
-        safe_user_id = "".join(c for c in user_id if c.isalnum() or c in ('_', '-'))
-        return os.path.join(self.storage_dir, f"{safe_user_id}.txt")
+        """Get the file path for a user's conversation history in text format"""
+        return os.path.join(self.storage_dir, f"{safe_user_id(user_id)}.txt")
+
+    def _get_summary_file_path(self, user_id: str) -> str:
+        """Get the file path for a user's running summary"""
+        return os.path.join(self.storage_dir, f"{safe_user_id(user_id)}.summary")
+
+    def _migrate_text_history(self, user_id: str) -> None:
+        """Import a history .txt written before switching to a log backend"""
+        user = self._user(user_id)
+        if self.backend == "text" or user.migrated:
+            return
+        user.migrated = True
+
+        file_path = self._get_user_file_path(user_id)
+        if self.storage.exists(user_id) or not os.path.exists(file_path):
+            return
+        for exchange in read_text_history(file_path):
+            self.storage.append(user_id, exchange)
     
     def add_exchange(self, user_id: str, question: str, answer: str) -> None:
         """
@@ -35,87 +229,31 @@ class ConversationMemory:
             question: User's question
             answer: Bot's answer
         """
-        file_path = self._get_user_file_path(user_id)
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        # Read existing history
-        history = self._read_history(user_id)
-        
-        # Append new exchange
         exchange = {
             "timestamp": timestamp,
             "question": question,
             "answer": answer
         }
-        history.append(exchange)
-        
-        # Keep only max_history recent exchanges
-        if len(history) > self.max_history:
-            history = history[-self.max_history:]
-        
-        # Write back to file
-        with open(file_path, 'w', encoding='utf-8') as f:
-            for ex in history:
-                f.write(f"[{ex['timestamp']}]\n")
-                f.write(f"Q: {ex['question']}\n")
-                f.write(f"A: {ex['answer']}\n")
-                f.write("\n---\n\n")
-    
-    def _read_history(self, user_id: str) -> List[Dict]:
-        """
-        Read conversation history from file
-        
-        Returns:
-            List of conversation exchanges as dictionaries
-        """
-        file_path = self._get_user_file_path(user_id)
-        
-        if not os.path.exists(file_path):
-            return []
-        
-        history = []
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Parse the file content
-            exchanges = content.split('\n---\n')
-            for exchange_text in exchanges:
-                exchange_text = exchange_text.strip()
-                if not exchange_text:
-                    continue
-                
-                lines = exchange_text.split('\n')
-                if len(lines) >= 3:
-                    timestamp_line = lines[0]
-                    question_line = lines[1]
-                    answer_line = lines[2]
-                    
-                    # Extract timestamp
-                    timestamp = timestamp_line.strip('[]').strip()
-                    
-                    # Extract question (remove "Q: " prefix)
-                    question = question_line[3:] if question_line.startswith('Q: ') else question_line
-                    
-                    # Extract answer (handle multi-line answers)
-                    answer_lines = []
-                    for i in range(2, len(lines)):
-                        if lines[i].startswith('A: '):
-                            answer_lines.append(lines[i][3:])
-                        elif answer_lines:  # continuation of answer
-                            answer_lines.append(lines[i])
-                    answer = '\n'.join(answer_lines)
-                    
-                    history.append({
-                        "timestamp": timestamp,
-                        "question": question,
-                        "answer": answer
-                    })
-        except Exception as e:
-            print(f"Error reading history for {user_id}: {e}")
-            return []
-        
-        return history
+
+        with self._locked(user_id) as user:
+            entry = self._load(user_id)
+            evicted = self.storage.append(user_id, exchange)
+            generation = user.generation
+
+            # Write-through: the backend has it, now update the cached window
+            history = entry["history"] + [exchange]
+            self._remember(user_id, {
+                "history": history[-self.max_history:],
+                "count": entry["count"] + 1,
+                "version": self.storage.version(user_id) if self.file_lock else None,
+                "user": user,
+            })
+
+        # Fold what falls out of the window into the running summary
+        if evicted and self._summarizer is not None:
+            self._summarizer.submit(self._fold_into_summary, user_id, user, evicted, generation)
     
     def get_history(self, user_id: str) -> List[Dict]:
         """
@@ -125,9 +263,26 @@ class ConversationMemory:
             user_id: User identifier
             
         Returns:
-            List of conversation exchanges
+            List of the last max_history conversation exchanges
+        """
+        with self._locked(user_id):
+            return list(self._load(user_id)["history"])
+
+    def export_text(self, user_id: str, file_path: Optional[str] = None) -> str:
+        """
+        Write the user's full stored history in the plain text format
+        
+        Returns:
+            Path of the text file (storage_dir/<user>.txt by default)
         """
-        return self._read_history(user_id)
+        file_path = file_path or self._get_user_file_path(user_id)
+        if self.backend == "text" and file_path == self._get_user_file_path(user_id):
+            return file_path
+
+        with self._locked(user_id):
+            self._migrate_text_history(user_id)
+            write_text_history(file_path, self.storage.all(user_id))
+        return file_path
     
     def format_history_for_prompt(self, user_id: str) -> str:
         """
@@ -139,22 +294,33 @@ class ConversationMemory:
         Returns:
             Formatted string of conversation history, empty if no history
         """
-        history = self.get_history(user_id)
-        
-        if not history:
+        return format_history(self.get_history(user_id), self.get_summary(user_id))
+
+    def get_summary(self, user_id: str) -> str:
+        """Running summary of exchanges evicted from the window (compaction mode)"""
+        summary_path = self._get_summary_file_path(user_id)
+        if not os.path.exists(summary_path):
             return ""
-        
-        formatted = "=== PREVIOUS CONVERSATION HISTORY ===\n"
-        formatted += "You have access to the following conversation history with this user.\n"
-        formatted += "Use this context to provide continuity and reference previous discussions when relevant.\n\n"
-        
-        for i, exchange in enumerate(history, 1):
-            formatted += f"[{exchange['timestamp']}]\n"
-            formatted += f"User: {exchange['question']}\n"
-            formatted += f"You: {exchange['answer']}\n\n"
-        
-        formatted += "=== END OF CONVERSATION HISTORY ===\n\n"
-        return formatted
+        with open(summary_path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+
+    def _fold_into_summary(self, user_id: str, user: _UserState, evicted: List[Dict], generation: int) -> None:
+        # The LLM call runs without the lock, so it does not hold up the user's answers
+        try:
+            summary = self.summarize_fn(self.get_summary(user_id), evicted).strip()
+        except Exception as e:
+            print(f"Error summarizing history for {user_id}: {e}")
+            return
+
+        # user keeps the state alive, so _locked() hands back the same object
+        with self._locked(user_id):
+            if user.generation != generation:
+                print(f"History of {user_id} was cleared while summarizing, dropping the summary")
+                return
+            summary_path = self._get_summary_file_path(user_id)
+            with open(summary_path + ".tmp", 'w', encoding='utf-8') as f:
+                f.write(summary)
+            os.replace(summary_path + ".tmp", summary_path)
     
     def clear_history(self, user_id: str) -> bool:
         """
@@ -166,18 +332,29 @@ class ConversationMemory:
         Returns:
             True if history was cleared, False if no history existed
         """
-        file_path = self._get_user_file_path(user_id)
-        
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            return True
-        return False
+        with self._locked(user_id) as user:
+            self._migrate_text_history(user_id)
+            user.generation += 1
+
+            summary_path = self._get_summary_file_path(user_id)
+            if os.path.exists(summary_path):
+                os.remove(summary_path)
+
+            # Remove a text export too, so it is not imported again later
+            file_path = self._get_user_file_path(user_id)
+            if self.backend != "text" and os.path.exists(file_path):
+                os.remove(file_path)
+
+            with self._cache_lock:
+                self._cache.pop(user_id, None)
+            return self.storage.clear(user_id)
     
     def get_conversation_count(self, user_id: str) -> int:
-        """Get the number of conversation exchanges for a user"""
-        return len(self.get_history(user_id))
+        """Get the number of conversation exchanges (within the window) for a user"""
+        with self._locked(user_id):
+            return min(self._load(user_id)["count"], self.max_history)
     
     def user_has_history(self, user_id: str) -> bool:
         """Check if a user has any conversation history"""
-        file_path = self._get_user_file_path(user_id)
-        return os.path.exists(file_path) and os.path.getsize(file_path) > 0
+        with self._locked(user_id):
+            return self._load(user_id)["count"] > 0
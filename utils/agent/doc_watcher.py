@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+
+from utils.agent.RAG import IndexMismatchError
+from utils.text_processing import list_document_files
+
+
+def snapshot_documents(folder):
+    """(mtime_ns, size) of every document, cheap enough to poll every few seconds"""
+    stamps = {}
+    for path in list_document_files(folder):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        stamps[path] = (st.st_mtime_ns, st.st_size)
+    return stamps
+
+
+class DocumentWatcher:
+    """
+    Polls a document folder in a background thread and calls on_change()
+    once a change has settled (the folder looked the same on two polls in a
+    row, so a file that is still being copied is not indexed half-written).
+    Polling needs no extra dependency and also works on network and Docker
+    mounts, where inotify events are often missing.
+
+    If on_change() raises, it is retried on later polls with a growing
+    delay until it succeeds. With initial=True it is also called on the
+    first poll, for a state that has never been indexed.
+    """
+
+    def __init__(self, folder, on_change, interval=2.0, max_retry_delay=60.0, initial=False):
+        self.folder = folder
+        self.on_change = on_change
+        self.interval = interval
+        self.max_retry_delay = max_retry_delay
+
+        self._indexed = None if initial else snapshot_documents(folder)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="document-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        previous = snapshot_documents(self.folder)
+        retry_delay = self.interval
+        delay = self.interval
+        while not self._stop.wait(delay):
+            delay = self.interval
+            current = snapshot_documents(self.folder)
+            if current != self._indexed and current == previous:
+                try:
+                    self.on_change()
+                    self._indexed = current
+                    retry_delay = self.interval
+                except Exception as e:
+                    retry_delay = min(retry_delay * 2, self.max_retry_delay)
+                    delay = retry_delay
+                    print(f"Document update failed, retrying in {delay:.0f}s: {e}")
+            previous = current
+
+
+class ReloadableRAG:
+    """
+    Holds the RAG instance currently serving queries and replaces it when
+    the documents change.
+
+    The replacement is built in the watcher thread by calling factory()
+    again; the RAG constructor loads the persisted index and re-embeds only
+    the documents that changed. Once it is ready, it is swapped in with a
+    single assignment, so retrieve() calls never wait for a rebuild and
+    calls already running on the old instance finish on it.
+
+    If loader is given, it is tried first at startup (typically a read-only
+    RAG over prebuilt artifacts, which loads in well under a second). When
+    it fails with IndexMismatchError, current stays None and the index is
+    built by the watcher thread while the server is already running. When
+    it loads but documents changed since the index was built, the loaded
+    index serves until the watcher has built an updated one.
+
+    Attribute access is forwarded to the current instance. Code that makes
+    several calls for one request should take rag.current once, so they
+    all see the same index.
+    """
+
+    def __init__(self, factory, folder="documents", interval=2.0, watch=True, loader=None):
+        self._factory = factory
+        self._reload_lock = threading.Lock()
+        self.current = None
+        self.reloads = 0
+
+        # Documents the loaded index is missing or has outdated
+        self.stale = []
+        if loader is None:
+            self.current = factory()
+        else:
+            try:
+                self.current = loader()
+            except IndexMismatchError as e:
+                print(f"Prebuilt index not usable ({e}), building it in the background")
+            else:
+                changed, removed = self.current.stale_documents()
+                self.stale = changed + removed
+                if self.stale:
+                    print(
+                        f"Prebuilt index is stale ({len(changed)} changed, {len(removed)} removed document(s))"
+                        + (", updating it in the background" if watch else "")
+                    )
+
+        # The folder snapshot is only a valid baseline if the index matches it
+        self.watcher = DocumentWatcher(
+            folder, self.reload, interval=interval, initial=self.current is None or bool(self.stale)
+        )
+        if watch:
+            self.watcher.start()
+
+    def reload(self):
+        """Build a fresh RAG for the current documents and swap it in"""
+        with self._reload_lock:
+            start = time.time()
+            print("Updating RAG index in the background...")
+            rag = self._factory()
+            previous, self.current = self.current, rag
+            self.reloads += 1
+            changed = previous is None or rag.index_version != previous.index_version
+            print(
+                f"RAG index swapped in ({time.time() - start:.1f}s, "
+                f"{rag.index.ntotal if rag.index is not None else 0} chunks, "
+                f"changed: {changed})"
+            )
+
+    def __getattr__(self, name):
+        if name == "current":
+            raise AttributeError(name)
+        return getattr(self.current, name)
@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Normalize width, case and whitespace so trivially different queries share a key"""
+    query = unicodedata.normalize("NFKC", query)
+    return " ".join(query.split()).lower()
+
+
+class QueryEmbeddingCache:
+    def __init__(self, max_entries=1024, db_path=None):
+        """
+        Bounded LRU cache of query vectors, keyed by (model, normalized query)
+
+        Args:
+            max_entries: Maximum number of vectors kept in memory
+            db_path: Optional SQLite file used as a second, persistent tier
+        """
+        self.max_entries = max_entries
+        self.db_path = db_path
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if db_path:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "model TEXT, query TEXT, vector BLOB, PRIMARY KEY (model, query))"
+            )
+            self._db.commit()
+
+    def get(self, model: str, query: str):
+        """Return the cached vector (1-D float32) or None"""
+        key = (model, normalize_query(query))
+
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vector FROM query_embeddings WHERE model = ? AND query = ?",
+                    key,
+                ).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype="float32")
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, model: str, query: str, vector) -> None:
+        key = (model, normalize_query(query))
+        vector = np.asarray(vector, dtype="float32").reshape(-1)
+
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (model, query, vector) VALUES (?, ?, ?)",
+                    (key[0], key[1], vector.tobytes()),
+                )
+                self._db.commit()
+
+    def get_or_embed(self, model: str, query: str, embed_fn):
+        """
+        Return the query vector, calling embed_fn([query]) only on a miss
+
+        Returns:
+            float32 array of shape (1, dim), ready for index.search
+        """
+        vector = self.get(model, query)
+        if vector is None:
+            vector = embed_fn([query])[0]
+            self.put(model, query, vector)
+        return np.asarray(vector, dtype="float32").reshape(1, -1)
+
+    def _remember(self, key, vector):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,317 @@
+import math
+import time
+
+import faiss
+import numpy as np
+
+
+INDEX_TYPES = ("auto", "flat", "hnsw", "ivfpq")
+
+# How flat/HNSW indexes store vectors: None = float32, "fp16" = half floats
+# (2x smaller), "sq8" = one byte per dimension (4x), "pq" = pq_m bytes per
+# vector (64x at the default pq_m). IVF-PQ always stores PQ codes.
+COMPRESSIONS = (None, "fp16", "sq8", "pq")
+_SQ_TYPES = {"fp16": faiss.ScalarQuantizer.QT_fp16, "sq8": faiss.ScalarQuantizer.QT_8bit}
+
+# Corpus sizes (number of chunks) at which "auto" switches index type
+HNSW_MIN_VECTORS = 5_000
+IVFPQ_MIN_VECTORS = 200_000
+
+# IVF-PQ cannot be trained meaningfully on fewer vectors than this
+IVFPQ_MIN_TRAIN = 1_000
+
+
+def choose_index_type(n_vectors):
+    """Pick an index type for a corpus of n_vectors chunks"""
+    if n_vectors >= IVFPQ_MIN_VECTORS:
+        return "ivfpq"
+    if n_vectors >= HNSW_MIN_VECTORS:
+        return "hnsw"
+    return "flat"
+
+
+def resolve_index_type(index_type, n_vectors):
+    """Concrete index type to build for n_vectors ("auto" and too-small IVF-PQ resolved)"""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+    if index_type == "auto":
+        return choose_index_type(n_vectors)
+    if index_type == "ivfpq" and n_vectors < IVFPQ_MIN_TRAIN:
+        return "flat"
+    return index_type
+
+
+def _pq_m(dim, requested=None):
+    """Number of PQ sub-quantizers: must divide dim"""
+    m = requested or max(dim // 16, 1)
+    while dim % m:
+        m -= 1
+    return m
+
+
+# FAISS k-means warns below this many training points per centroid
+_MIN_POINTS_PER_CENTROID = 39
+
+
+def _pq_nbits(n):
+    """Bits per PQ code: at most 2^8 centroids per sub-quantizer, and no more than n points can train"""
+    return max(1, min(8, int(math.log2(max(n // _MIN_POINTS_PER_CENTROID, 2)))))
+
+
+def _storage_index(dim, compression, n, pq_m=None):
+    """Flat storage of the given compression (None = exact float32)"""
+    if compression is None:
+        return faiss.IndexFlatL2(dim)
+    if compression in _SQ_TYPES:
+        return faiss.IndexScalarQuantizer(dim, _SQ_TYPES[compression])
+    return faiss.IndexPQ(dim, _pq_m(dim, pq_m), _pq_nbits(n))
+
+
+def build_index(
+    vectors,
+    ids,
+    index_type="auto",
+    hnsw_m=32,
+    ef_construction=80,
+    nlist=None,
+    pq_m=None,
+    compression=None,
+):
+    """
+    Create an index of the given type holding vectors under the given int64 ids.
+
+    - flat: exact brute-force search (IndexFlatL2 behind an ID map)
+    - hnsw: graph index, fast approximate search, keeps full vectors. Removing
+      vectors is not supported by FAISS; see RAG._remove_document.
+    - ivfpq: inverted lists with product-quantized codes; needs training and
+      stores only compressed vectors. Uses the IVF's own ids.
+
+    compression (see COMPRESSIONS) makes flat and HNSW indexes store
+    quantized vectors instead of float32; distances become approximate.
+    The quantizer is trained on the given vectors.
+
+    Returns:
+        (index, index_type) with the concrete type that was built ("auto"
+        resolved; IVF-PQ falls back to flat below IVFPQ_MIN_TRAIN vectors)
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    ids = np.asarray(ids, dtype="int64")
+    n, dim = vectors.shape
+
+    index_type = resolve_index_type(index_type, n)
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression '{compression}', expected one of {COMPRESSIONS}")
+
+    if index_type == "flat":
+        index = faiss.IndexIDMap2(_storage_index(dim, compression, n, pq_m))
+
+    elif index_type == "hnsw":
+        if compression is None:
+            hnsw = faiss.IndexHNSWFlat(dim, hnsw_m)
+        elif compression == "pq":
+            hnsw = faiss.IndexHNSWPQ(dim, _pq_m(dim, pq_m), hnsw_m, _pq_nbits(n))
+        else:
+            hnsw = faiss.IndexHNSWSQ(dim, _SQ_TYPES[compression], hnsw_m)
+        hnsw.hnsw.efConstruction = ef_construction
+        index = faiss.IndexIDMap2(hnsw)
+
+    else:
+        # Rule of thumb: ~4*sqrt(n) lists, with enough points per list to train
+        nlist = nlist or max(1, min(int(4 * math.sqrt(n)), n // 39))
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_m(dim, pq_m), _pq_nbits(n))
+        index.train(vectors)
+        # Lets reconstruct() find vectors by id (reranking, index conversion)
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+    if not index.is_trained:
+        index.train(vectors)
+    if n:
+        index.add_with_ids(vectors, ids)
+    return index, index_type
+
+
+def set_search_params(index, ef_search=None, nprobe=None):
+    """Apply query-time parameters; those not relevant to the index type are ignored"""
+    params = faiss.ParameterSpace()
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+
+    if ef_search and isinstance(inner, faiss.IndexHNSW):
+        params.set_index_parameter(index, "efSearch", ef_search)
+    if nprobe and isinstance(inner, faiss.IndexIVF):
+        params.set_index_parameter(index, "nprobe", nprobe)
+
+
+def index_type_of(index):
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivfpq"
+    return "flat"
+
+
+def compression_of(index):
+    """Compression of a flat or HNSW index (None for float32 and IVF-PQ)"""
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        inner = faiss.downcast_index(inner.storage)
+    if isinstance(inner, faiss.IndexScalarQuantizer):
+        return "fp16" if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    if isinstance(inner, faiss.IndexPQ):
+        return "pq"
+    return None
+
+
+def exact_rescore(query_vec, ids, vectors, k):
+    """
+    Re-rank candidates of an approximate search by their exact L2 distance.
+
+    Args:
+        query_vec: (1, dim) query
+        ids: Candidate ids
+        vectors: (len(ids), dim) their full-precision vectors
+
+    Returns:
+        (ids, distances) of the k closest, closest first
+    """
+    if not len(ids):
+        return [], []
+    distances = ((np.asarray(vectors, dtype="float32") - query_vec) ** 2).sum(axis=1)
+    order = np.argsort(distances, kind="stable")[:k]
+    return [int(ids[i]) for i in order], [float(distances[i]) for i in order]
+
+
+def reconstruct_all(index, ids):
+    """Stored vectors for ids (decoded approximations for PQ indexes)"""
+    ids = list(ids)
+    if not ids:
+        return np.zeros((0, index.d), dtype="float32")
+    return np.vstack([index.reconstruct(int(i)) for i in ids]).astype("float32")
+
+
+def index_memory_bytes(index):
+    return faiss.serialize_index(index).nbytes
+
+
+def recall_report(vectors, queries, k=3, configs=None):
+    """
+    Compare index configurations against exact flat search.
+
+    Args:
+        vectors: (n, dim) corpus vectors
+        queries: (q, dim) query vectors
+        k: Neighbours per query
+        configs: List of dicts with build_index/set_search_params keyword
+            arguments (index_type, compression, hnsw_m, nlist, pq_m,
+            ef_search, nprobe, ...). "rescore": N searches N*k candidates
+            and re-ranks them by exact distance, as RAG does with rescore.
+
+    Returns:
+        One dict per config: recall@k vs flat, mean ms per query, index
+        bytes and the fraction of the flat index's memory saved
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    queries = np.ascontiguousarray(queries, dtype="float32")
+    ids = np.arange(len(vectors), dtype="int64")
+
+    if configs is None:
+        configs = [
+            {"index_type": "flat"},
+            {"index_type": "hnsw", "ef_search": 16},
+            {"index_type": "hnsw", "ef_search": 64},
+            {"index_type": "ivfpq", "nprobe": 1},
+            {"index_type": "ivfpq", "nprobe": 8},
+            {"index_type": "ivfpq", "nprobe": 32},
+            {"index_type": "flat", "compression": "fp16"},
+            {"index_type": "flat", "compression": "sq8"},
+            {"index_type": "flat", "compression": "pq"},
+            {"index_type": "flat", "compression": "pq", "rescore": 4},
+            {"index_type": "hnsw", "compression": "sq8", "ef_search": 64},
+        ]
+
+    flat, _ = build_index(vectors, ids, "flat")
+    _, truth = flat.search(queries, k)
+    flat_bytes = index_memory_bytes(flat)
+
+    rows = []
+    for config in configs:
+        config = dict(config)
+        search_params = {key: config.pop(key) for key in ("ef_search", "nprobe") if key in config}
+        rescore = config.pop("rescore", None)
+
+        start = time.time()
+        index, index_type = build_index(vectors, ids, **config)
+        build_seconds = time.time() - start
+        set_search_params(index, **search_params)
+
+        start = time.time()
+        if rescore:
+            _, candidates = index.search(queries, k * rescore)
+            found = [
+                exact_rescore(query.reshape(1, -1), row[row >= 0], vectors[row[row >= 0]], k)[0]
+                for query, row in zip(queries, candidates)
+            ]
+        else:
+            found = index.search(queries, k)[1].tolist()
+        search_seconds = time.time() - start
+
+        hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth.tolist()))
+        index_bytes = index_memory_bytes(index)
+        rows.append({
+            "index_type": index_type,
+            **config,
+            **search_params,
+            **({"rescore": rescore} if rescore else {}),
+            "recall": hits / (len(queries) * k),
+            "ms_per_query": 1000 * search_seconds / max(len(queries), 1),
+            "build_seconds": build_seconds,
+            "bytes": index_bytes,
+            "saved": 1 - index_bytes / flat_bytes,
+        })
+    return rows
+
+
+def print_report(rows):
+    # Recall is measured against exact flat search, so 1 - recall is the loss
+    print(f"{'config':<48} {'recall':>7} {'ms/query':>9} {'build s':>8} {'MB':>8} {'saved':>7}")
+    for row in rows:
+        name = ", ".join(
+            f"{key}={value}" for key, value in row.items()
+            if key not in ("recall", "ms_per_query", "build_seconds", "bytes", "saved")
+        )
+        print(
+            f"{name:<48} {row['recall']:>7.3f} {row['ms_per_query']:>9.3f} "
+            f"{row['build_seconds']:>8.2f} {row['bytes'] / 1e6:>8.2f} {row['saved']:>7.1%}"
+        )
+
+
+if __name__ == "__main__":
+    # Recall-vs-latency report for the persisted RAG index (or synthetic data)
+    import argparse
+
+    from utils.agent.chunk_store import ChunkStore
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", default="rag/faiss.index")
+    parser.add_argument("--chunks", default="rag/chunks", help="chunk store directory")
+    parser.add_argument("--synthetic", type=int, default=0, help="use N random vectors instead")
+    parser.add_argument("--dim", type=int, default=1024, help="dimension of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        corpus = rng.standard_normal((args.synthetic, args.dim)).astype("float32")
+    else:
+        chunk_ids = ChunkStore(args.chunks).ids()
+        corpus = reconstruct_all(faiss.read_index(args.index), chunk_ids)
+
+    # Queries: perturbed corpus vectors, so every query has real neighbours
+    picks = rng.integers(0, len(corpus), args.queries)
+    noise = rng.standard_normal((args.queries, corpus.shape[1])).astype("float32")
+    queries = corpus[picks] + 0.1 * noise * corpus.std()
+
+    print(f"{len(corpus)} vectors, dim {corpus.shape[1]}, {args.queries} queries, k={args.k}")
+    print_report(recall_report(corpus, queries, k=args.k))
@@ -0,0 +1,205 @@
+"""
+Admission control in front of Ollama. A local Ollama only serves a few
+requests at a time efficiently, so every generation (and every embedding
+batch of an index build) takes a slot first:
+
+    with scheduler.slot("chat", user_id=user_id):
+        r = get_client().post(CHAT_URL, ...)
+
+When all slots are busy, requests wait in one queue per priority class and a
+freed slot goes to the highest class with waiters (chat before summaries
+before index builds). Within a class, users take turns, so one user's burst
+of requests cannot starve everyone else. A full queue rejects new work at
+once (LLMBusyError) and queued work that waited past its deadline is dropped
+(LLMDeadlineError), so callers can answer "busy, please retry" quickly.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from utils.metrics import metrics
+
+# Served in this order
+PRIORITIES = ("chat", "summary", "index")
+
+
+class LLMBusyError(Exception):
+    """The request was not run because the model is overloaded"""
+
+
+class LLMDeadlineError(LLMBusyError):
+    """The request waited in the queue past its deadline"""
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrent=2, max_queued=None, deadlines=None):
+        """
+        Args:
+            max_concurrent: Requests sent to Ollama at the same time
+            max_queued: {priority: most requests allowed to wait}; None (or
+                a missing class) means no limit
+            deadlines: {priority: seconds a request may wait for a slot}
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queued = {"chat": 16, "summary": 8, "index": None}
+        self.deadlines = {"chat": 30.0, "summary": 600.0, "index": None}
+        self.max_queued.update(max_queued or {})
+        self.deadlines.update(deadlines or {})
+
+        self._lock = threading.Lock()
+        self._running = 0
+        # priority -> OrderedDict(user_id -> deque of waiting Events), in turn order
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}
+        self._queued = {priority: 0 for priority in PRIORITIES}
+
+        self.shed = 0
+        self.expired = 0
+
+    def configure(self, max_concurrent=None, max_queued=None, deadlines=None):
+        with self._lock:
+            if max_concurrent is not None:
+                self.max_concurrent = max_concurrent
+            self.max_queued.update(max_queued or {})
+            self.deadlines.update(deadlines or {})
+            self._dispatch()
+
+    def admits(self, priority="chat") -> bool:
+        """Whether a request of this class would be queued rather than shed"""
+        limit = self.max_queued.get(priority)
+        with self._lock:
+            return limit is None or self._queued[priority] < limit
+
+    def try_admit(self, priority="chat") -> bool:
+        """
+        Like admits(), but a refusal is counted as shed, the same as a full
+        queue in slot(). For callers that reject work before starting it.
+        """
+        limit = self.max_queued.get(priority)
+        with self._lock:
+            if limit is None or self._queued[priority] < limit:
+                return True
+            self._shed(priority)
+            return False
+
+    def _shed(self, priority):
+        """Count one rejected request (call with the lock held)"""
+        self.shed += 1
+        metrics.inc("llm_shed_total", priority=priority)
+
+    @contextmanager
+    def slot(self, priority="chat", user_id=None, deadline=None):
+        """
+        Hold one of the max_concurrent slots for the duration of the block.
+
+        Args:
+            priority: One of PRIORITIES
+            user_id: Requests of different users are served in turns
+            deadline: Seconds to wait for a slot, instead of the class default
+
+        Raises:
+            LLMBusyError if the class's queue is full
+            LLMDeadlineError if no slot was free within the deadline
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}', expected one of {PRIORITIES}")
+        self._acquire(priority, user_id or "", deadline)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._dispatch()
+
+    def _acquire(self, priority, user_id, deadline):
+        start = time.time()
+        with self._lock:
+            if self._running < self.max_concurrent and not any(self._queued.values()):
+                self._running += 1
+                return
+
+            limit = self.max_queued.get(priority)
+            if limit is not None and self._queued[priority] >= limit:
+                self._shed(priority)
+                raise LLMBusyError(f"{self._queued[priority]} {priority} request(s) already waiting")
+
+            granted = threading.Event()
+            self._queues[priority].setdefault(user_id, deque()).append(granted)
+            self._queued[priority] += 1
+
+        timeout = deadline if deadline is not None else self.deadlines.get(priority)
+        if not granted.wait(timeout):
+            with self._lock:
+                # The slot may have been handed over just as the wait timed out
+                if not granted.is_set():
+                    waiters = self._queues[priority][user_id]
+                    waiters.remove(granted)
+                    if not waiters:
+                        del self._queues[priority][user_id]
+                    self._queued[priority] -= 1
+                    self.expired += 1
+                    metrics.inc("llm_expired_total", priority=priority)
+                    raise LLMDeadlineError(f"No free slot for {priority} request within {timeout:.0f}s")
+
+        metrics.observe("llm_queue_seconds", time.time() - start, priority=priority)
+
+    def _dispatch(self):
+        """Hand free slots to waiters (call with the lock held)"""
+        while self._running < self.max_concurrent:
+            granted = self._next_waiter()
+            if granted is None:
+                return
+            self._running += 1
+            granted.set()
+
+    def _next_waiter(self):
+        for priority in PRIORITIES:
+            users = self._queues[priority]
+            if not users:
+                continue
+            # The user at the front gets one request through, then goes to the back
+            user_id, waiters = next(iter(users.items()))
+            granted = waiters.popleft()
+            if waiters:
+                users.move_to_end(user_id)
+            else:
+                del users[user_id]
+            self._queued[priority] -= 1
+            return granted
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self._running,
+                "queued": dict(self._queued),
+                "shed": self.shed,
+                "expired": self.expired,
+            }
+
+
+scheduler = LLMScheduler(max_concurrent=int(os.getenv("OLLAMA_MAX_CONCURRENT", "2")))
+
+
+if __name__ == "__main__":
+    # Two slots, a low-priority backlog, then chat requests from two users:
+    # the chat requests overtake the backlog and alternate between users
+    demo = LLMScheduler(max_concurrent=2)
+    order = []
+
+    def job(priority, user_id):
+        with demo.slot(priority, user_id):
+            order.append(f"{priority}:{user_id}")
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=job, args=("index", "build")) for _ in range(4)]
+    threads += [threading.Thread(target=job, args=("chat", "alice")) for _ in range(3)]
+    threads += [threading.Thread(target=job, args=("chat", "bob"))]
+    for t in threads:
+        t.start()
+        time.sleep(0.005)
+    for t in threads:
+        t.join()
+    print(order)
+    print(demo.stats())
@@ -0,0 +1,339 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import List, Dict
+
+
+def safe_user_id(user_id: str) -> str:
+    """Sanitize user_id to be safe for filenames"""
+    return "".join(c for c in user_id if c.isalnum() or c in ('_', '-'))
+
+
+def write_text_history(file_path: str, history: List[Dict]) -> None:
+    """Write exchanges in the plain text format (also used as the export format)"""
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for ex in history:
+            f.write(f"[{ex['timestamp']}]\n")
+            f.write(f"Q: {ex['question']}\n")
+            f.write(f"A: {ex['answer']}\n")
+            f.write("\n---\n\n")
+
+
+def read_text_history(file_path: str) -> List[Dict]:
+    """
+    Parse a history file written by write_text_history
+
+    Returns:
+        List of conversation exchanges as dictionaries
+    """
+    if not os.path.exists(file_path):
+        return []
+
+    history = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    # Parse the file content
+    exchanges = content.split('\n---\n')
+    for exchange_text in exchanges:
+        exchange_text = exchange_text.strip()
+        if not exchange_text:
+            continue
+
+        lines = exchange_text.split('\n')
+        if len(lines) >= 3:
+            timestamp_line = lines[0]
+            question_line = lines[1]
+
+            # Extract timestamp
+            timestamp = timestamp_line.strip('[]').strip()
+
+            # Extract question (remove "Q: " prefix)
+            question = question_line[3:] if question_line.startswith('Q: ') else question_line
+
+            # Extract answer (handle multi-line answers)
+            answer_lines = []
+            for i in range(2, len(lines)):
+                if lines[i].startswith('A: '):
+                    answer_lines.append(lines[i][3:])
+                elif answer_lines:  # continuation of answer
+                    answer_lines.append(lines[i])
+            answer = '\n'.join(answer_lines)
+
+            history.append({
+                "timestamp": timestamp,
+                "question": question,
+                "answer": answer
+            })
+
+    return history
+
+
+class TextStorage:
+    """Original format: one rewritten .txt file per user holding the window"""
+
+    def __init__(self, storage_dir: str, max_history: int):
+        self.storage_dir = storage_dir
+        self.max_history = max_history
+
+    def path(self, user_id: str) -> str:
+        return os.path.join(self.storage_dir, f"{safe_user_id(user_id)}.txt")
+
+    def _read(self, user_id: str) -> List[Dict]:
+        try:
+            return read_text_history(self.path(user_id))
+        except Exception as e:
+            print(f"Error reading history for {user_id}: {e}")
+            return []
+
+    def append(self, user_id: str, exchange: Dict) -> List[Dict]:
+        """Store exchange; returns the exchanges that fell out of the window"""
+        history = self._read(user_id)
+        history.append(exchange)
+
+        evicted = history[:-self.max_history]
+        history = history[-self.max_history:]
+
+        write_text_history(self.path(user_id), history)
+        return evicted
+
+    def tail(self, user_id: str, n: int) -> List[Dict]:
+        return self._read(user_id)[-n:] if n > 0 else []
+
+    def all(self, user_id: str) -> List[Dict]:
+        return self._read(user_id)
+
+    def count(self, user_id: str) -> int:
+        return len(self._read(user_id))
+
+    def exists(self, user_id: str) -> bool:
+        file_path = self.path(user_id)
+        return os.path.exists(file_path) and os.path.getsize(file_path) > 0
+
+    def clear(self, user_id: str) -> bool:
+        file_path = self.path(user_id)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            return True
+        return False
+
+    def version(self, user_id: str):
+        """Cheap stamp that changes whenever the user's history does"""
+        return _file_stamp(self.path(user_id))
+
+
+class JsonlStorage:
+    """
+    Append-only log: one JSON line per exchange in <user>.jsonl. Appends never
+    rewrite the file; once it holds compact_after lines beyond the window it
+    is rewritten with only the window (periodic compaction). Line counts are
+    cached per user (keyed by file mtime/size), and tails are read backwards
+    from the end of the file.
+    """
+
+    def __init__(self, storage_dir: str, max_history: int, compact_after: int = 100):
+        self.storage_dir = storage_dir
+        self.max_history = max_history
+        self.compact_after = compact_after
+
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def path(self, user_id: str) -> str:
+        return os.path.join(self.storage_dir, f"{safe_user_id(user_id)}.jsonl")
+
+    def _line_count(self, user_id: str) -> int:
+        # Cached count is only trusted while the file is unchanged (another
+        # process may append to it)
+        stamp = _file_stamp(self.path(user_id))
+        cached = self._counts.get(user_id)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        count = 0
+        if stamp is not None:
+            with open(self.path(user_id), 'rb') as f:
+                count = sum(1 for _ in f)
+        self._counts[user_id] = (stamp, count)
+        return count
+
+    def append(self, user_id: str, exchange: Dict) -> List[Dict]:
+        line = json.dumps(exchange, ensure_ascii=False) + "\n"
+        with self._lock:
+            count = self._line_count(user_id) + 1
+            with open(self.path(user_id), 'a', encoding='utf-8') as f:
+                f.write(line)
+            self._counts[user_id] = (_file_stamp(self.path(user_id)), count)
+
+            evicted = []
+            if count > self.max_history:
+                evicted = self.tail(user_id, self.max_history + 1)[:1]
+            if count > self.max_history + self.compact_after:
+                self._compact(user_id)
+            return evicted
+
+    def _compact(self, user_id: str) -> None:
+        window = self.tail(user_id, self.max_history)
+        tmp_path = self.path(user_id) + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for ex in window:
+                f.write(json.dumps(ex, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path(user_id))
+        self._counts[user_id] = (_file_stamp(self.path(user_id)), len(window))
+
+    def tail(self, user_id: str, n: int) -> List[Dict]:
+        file_path = self.path(user_id)
+        if n <= 0 or not os.path.exists(file_path):
+            return []
+
+        # Read blocks backwards until n complete lines have been seen
+        with open(file_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            data = b""
+            while position > 0 and data.count(b"\n") <= n:
+                step = min(8192, position)
+                position -= step
+                f.seek(position)
+                data = f.read(step) + data
+
+        lines = [line for line in data.split(b"\n") if line.strip()]
+        return [json.loads(line) for line in lines[-n:]]
+
+    def all(self, user_id: str) -> List[Dict]:
+        file_path = self.path(user_id)
+        if not os.path.exists(file_path):
+            return []
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def count(self, user_id: str) -> int:
+        with self._lock:
+            return self._line_count(user_id)
+
+    def exists(self, user_id: str) -> bool:
+        return self.count(user_id) > 0
+
+    def clear(self, user_id: str) -> bool:
+        with self._lock:
+            self._counts.pop(user_id, None)
+            if os.path.exists(self.path(user_id)):
+                os.remove(self.path(user_id))
+                return True
+            return False
+
+    def version(self, user_id: str):
+        """Cheap stamp that changes whenever the user's history does"""
+        return _file_stamp(self.path(user_id))
+
+
+class SQLiteStorage:
+    """
+    All users in one SQLite database in WAL mode. Exchanges are indexed by
+    (user_id, id) for tail reads, and a per-user counter row is updated in the
+    same transaction so counts never scan.
+    """
+
+    def __init__(self, storage_dir: str, max_history: int, db_name: str = "conversations.db"):
+        self.max_history = max_history
+        self.db_path = os.path.join(storage_dir, db_name)
+
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS exchanges ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, "
+                "timestamp TEXT, question TEXT, answer TEXT)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_exchanges_user ON exchanges (user_id, id)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS user_counts (user_id TEXT PRIMARY KEY, n INTEGER NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared across threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def append(self, user_id: str, exchange: Dict) -> List[Dict]:
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO exchanges (user_id, timestamp, question, answer) VALUES (?, ?, ?, ?)",
+                (user_id, exchange["timestamp"], exchange["question"], exchange["answer"]),
+            )
+            db.execute(
+                "INSERT INTO user_counts (user_id, n) VALUES (?, 1) "
+                "ON CONFLICT(user_id) DO UPDATE SET n = n + 1",
+                (user_id,),
+            )
+
+        if self.count(user_id) > self.max_history:
+            return self._rows(
+                "SELECT timestamp, question, answer FROM exchanges WHERE user_id = ? "
+                "ORDER BY id DESC LIMIT 1 OFFSET ?",
+                (user_id, self.max_history),
+            )
+        return []
+
+    def _rows(self, sql, params) -> List[Dict]:
+        rows = self._connect().execute(sql, params).fetchall()
+        return [{"timestamp": t, "question": q, "answer": a} for t, q, a in rows]
+
+    def tail(self, user_id: str, n: int) -> List[Dict]:
+        if n <= 0:
+            return []
+        rows = self._rows(
+            "SELECT timestamp, question, answer FROM exchanges WHERE user_id = ? "
+            "ORDER BY id DESC LIMIT ?",
+            (user_id, n),
+        )
+        return rows[::-1]
+
+    def all(self, user_id: str) -> List[Dict]:
+        return self._rows(
+            "SELECT timestamp, question, answer FROM exchanges WHERE user_id = ? ORDER BY id",
+            (user_id,),
+        )
+
+    def count(self, user_id: str) -> int:
+        row = self._connect().execute(
+            "SELECT n FROM user_counts WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def exists(self, user_id: str) -> bool:
+        return self.count(user_id) > 0
+
+    def clear(self, user_id: str) -> bool:
+        existed = self.exists(user_id)
+        with self._connect() as db:
+            db.execute("DELETE FROM exchanges WHERE user_id = ?", (user_id,))
+            db.execute("DELETE FROM user_counts WHERE user_id = ?", (user_id,))
+        return existed
+
+    def version(self, user_id: str):
+        """Cheap stamp that changes whenever the user's history does"""
+        return self._connect().execute(
+            "SELECT MAX(id) FROM exchanges WHERE user_id = ?", (user_id,)
+        ).fetchone()[0]
+
+
+def _file_stamp(file_path: str):
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+STORAGE_BACKENDS = {
+    "text": TextStorage,
+    "jsonl": JsonlStorage,
+    "sqlite": SQLiteStorage,
+}
@@ -1,7 +1,10 @@
 # ollama_client.py
 import os
+import threading
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 # -------------------------------------------
@@ -11,6 +14,122 @@ OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 
 CHAT_URL = f"{OLLAMA_HOST}/api/chat"
 EMBED_URL = f"{OLLAMA_HOST}/api/embeddings"
+EMBED_BATCH_URL = f"{OLLAMA_HOST}/api/embed"
+
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "3"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_RETRIES = int(os.getenv("OLLAMA_RETRIES", "2"))
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "16"))
+
+
+def _connection_error_message(host):
+    return (
+        f"❌ Could not connect to Ollama at {host}\n"
+        f"➡️ Start the server by running the command:\n\n"
+        f"    ollama serve\n\n"
+        f"Or specify a custom host with:\n"
+        f"    set OLLAMA_HOST=http://localhost:11435\n"
+    )
+
+
+# -------------------------------------------
+# POOLED CLIENT with cached health state
+# -------------------------------------------
+class OllamaClient:
+    def __init__(
+        self,
+        host=OLLAMA_HOST,
+        connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+        read_timeout=OLLAMA_READ_TIMEOUT,
+        retries=OLLAMA_RETRIES,
+        pool_size=OLLAMA_POOL_SIZE,
+        health_ttl=10.0,
+        max_backoff=30.0,
+    ):
+        """
+        Shared HTTP client for Ollama chat and embedding requests
+
+        Args:
+            host: Ollama base URL
+            connect_timeout: Seconds to wait for a TCP connection
+            read_timeout: Seconds to wait for a response (CPU generation is slow)
+            retries: Retries on connection errors (request never reached the server)
+            pool_size: Keep-alive connections kept open to Ollama
+            health_ttl: Seconds a successful health check / request is trusted
+            max_backoff: Upper bound on the wait between checks while Ollama is down
+        """
+        self.host = host
+        self.timeout = (connect_timeout, read_timeout)
+        self.health_ttl = health_ttl
+        self.max_backoff = max_backoff
+
+        retry = Retry(total=retries, connect=retries, read=0, status=0, backoff_factor=0.3)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._healthy_until = 0.0
+        self._next_check = 0.0
+        self._backoff = 0.5
+
+    def _mark_healthy(self):
+        with self._lock:
+            self._healthy_until = time.time() + self.health_ttl
+            self._backoff = 0.5
+
+    def _mark_unhealthy(self):
+        with self._lock:
+            self._healthy_until = 0.0
+            self._next_check = time.time() + self._backoff
+            self._backoff = min(self._backoff * 2, self.max_backoff)
+
+    def is_healthy(self) -> bool:
+        """Health state, re-checked with a GET only once the cached state is stale"""
+        now = time.time()
+        if now < self._healthy_until:
+            return True
+        # Still inside the backoff window after a failure: don't hammer the server
+        if now < self._next_check:
+            return False
+
+        try:
+            self.session.get(self.host, timeout=(self.timeout[0], 2))
+        except requests.exceptions.RequestException:
+            self._mark_unhealthy()
+            return False
+        self._mark_healthy()
+        return True
+
+    def post(self, url, json, stream=False, timeout=None):
+        if not self.is_healthy():
+            raise ConnectionError(_connection_error_message(self.host))
+
+        try:
+            r = self.session.post(url, json=json, stream=stream, timeout=timeout or self.timeout)
+        except requests.exceptions.ConnectionError:
+            self._mark_unhealthy()
+            raise ConnectionError(_connection_error_message(self.host))
+        except Exception as e:
+            raise RuntimeError(f"❌ Failed to communicate with Ollama: {e}")
+
+        # Any answer from the server proves it is up
+        self._mark_healthy()
+        return r
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> OllamaClient:
+    """Process-wide OllamaClient, created on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OllamaClient()
+        return _client
 
 
 # -------------------------------------------
@@ -18,13 +137,12 @@ EMBED_URL = f"{OLLAMA_HOST}/api/embeddings"
 # -------------------------------------------
 def wait_for_ollama(timeout=5):
     """Wait until Ollama is reachable. Returns True if OK, False otherwise."""
+    client = get_client()
     start = time.time()
     while time.time() - start < timeout:
-        try:
-            requests.get(OLLAMA_HOST, timeout=0.5)
+        if client.is_healthy():
             return True
-        except requests.exceptions.ConnectionError:
-            time.sleep(0.2)
+        time.sleep(0.2)
     return False
 
 
@@ -32,16 +150,4 @@ def wait_for_ollama(timeout=5):
 # SAFE POST with automatic detection and error message
 # -------------------------------------------
 def safe_post(url, json):
-    if not wait_for_ollama():
-        raise ConnectionError(
-            f"❌ Could not connect to Ollama at {OLLAMA_HOST}\n"
-            f"➡️ Start the server by running the command:\n\n"
-            f"    ollama serve\n\n"
-            f"Or specify a custom host with:\n"
-            f"    set OLLAMA_HOST=http://localhost:11435\n"
-        )
-
-    try:
-        return requests.post(url, json=json)
-    except Exception as e:
-        raise RuntimeError(f"❌ Failed to communicate with Ollama: {e}")
+    return get_client().post(url, json)
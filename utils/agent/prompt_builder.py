@@ -0,0 +1,175 @@
+from typing import Dict, List, Tuple
+
+from utils.agent.conversation_memory import format_history
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        0x3000 <= code <= 0x303F      # CJK punctuation
+        or 0x3400 <= code <= 0x4DBF   # CJK extension A
+        or 0x4E00 <= code <= 0x9FFF   # CJK unified ideographs
+        or 0xF900 <= code <= 0xFAFF   # CJK compatibility ideographs
+        or 0xFF00 <= code <= 0xFFEF   # full-width forms
+    )
+
+
+def _char_cost(ch: str) -> float:
+    # Llama-style tokenizers spend about one token per CJK character and
+    # about one token per four characters of English text
+    return 1.0 if _is_cjk(ch) else 0.25
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate, good enough for budgeting without a tokenizer"""
+    return int(sum(_char_cost(ch) for ch in text) + 0.999)
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Keep the longest prefix of text that fits in budget tokens"""
+    used = 0.0
+    for i, ch in enumerate(text):
+        used += _char_cost(ch)
+        if used > budget:
+            return text[:i]
+    return text
+
+
+def _overlap(a: str, b: str, min_len=20, max_len=400) -> int:
+    """Length of the longest suffix of a that is also a prefix of b"""
+    for size in range(min(len(a), len(b), max_len), min_len - 1, -1):
+        if a.endswith(b[:size]):
+            return size
+    return 0
+
+
+def dedupe_chunks(chunks: List[Dict]) -> List[str]:
+    """
+    Remove text repeated between retrieved chunks because of chunk overlap
+
+    Args:
+        chunks: Retrieved chunks ({"chunk", "source", ...}) in rank order
+
+    Returns:
+        Chunk texts in the same order, with repeated overlaps cut out
+    """
+    kept = []
+    for item in chunks:
+        text = item["chunk"]
+        for previous in kept:
+            # The new chunk may directly follow or directly precede a kept one
+            size = _overlap(previous, text)
+            if size:
+                text = text[size:]
+            size = _overlap(text, previous)
+            if size:
+                text = text[:-size]
+        if text.strip():
+            kept.append(text)
+    return kept
+
+
+class PromptBuilder:
+    def __init__(self, max_tokens=2048, history_share=0.35, min_chunk_tokens=64):
+        """
+        Assemble prompts under an explicit token budget
+
+        Args:
+            max_tokens: Budget for the whole prompt (template + history +
+                context + question)
+            history_share: Fraction of the space left after template and
+                question that history may use; the rest goes to document
+                context. Space one side does not need is given to the other.
+            min_chunk_tokens: Do not add a truncated chunk smaller than this
+        """
+        self.max_tokens = max_tokens
+        self.history_share = history_share
+        self.min_chunk_tokens = min_chunk_tokens
+
+    def _fit_history(self, history: List[Dict], budget: int, summary: str = "") -> Tuple[str, int]:
+        # The running summary stays; drop the oldest exchanges first until the rest fits
+        kept = list(history)
+        while kept and estimate_tokens(format_history(kept, summary)) > budget:
+            if len(kept) == 1:
+                # Even the latest exchange is too long: trim its answer instead
+                exchange = dict(kept[0])
+                overflow = estimate_tokens(format_history(kept, summary)) - budget
+                answer_budget = estimate_tokens(exchange["answer"]) - overflow
+                if answer_budget <= 0:
+                    kept = []
+                    break
+                exchange["answer"] = truncate_to_tokens(exchange["answer"], answer_budget) + "…"
+                kept = [exchange]
+                break
+            kept.pop(0)
+
+        if not kept and summary:
+            overflow = estimate_tokens(format_history([], summary)) - budget
+            if overflow > 0:
+                summary_budget = estimate_tokens(summary) - overflow
+                summary = truncate_to_tokens(summary, summary_budget) + "…" if summary_budget > 0 else ""
+        return format_history(kept, summary), len(kept)
+
+    def _fit_context(self, chunks: List[Dict], budget: int) -> Tuple[str, int]:
+        separator = "\n\n---\n\n"
+        parts = []
+        used = 0
+        for text in dedupe_chunks(chunks):
+            cost = estimate_tokens(text) + (estimate_tokens(separator) if parts else 0)
+            if used + cost <= budget:
+                parts.append(text)
+                used += cost
+                continue
+            remaining = budget - used
+            if remaining >= self.min_chunk_tokens:
+                parts.append(truncate_to_tokens(text, remaining))
+            break
+        return separator.join(parts), len(parts)
+
+    def build(
+        self,
+        template: str,
+        question: str,
+        history: List[Dict],
+        chunks: List[Dict],
+        summary: str = "",
+    ):
+        """
+        Fill template ({conversation_history}, {document_context} and
+        {question} placeholders) within the token budget. summary is the
+        running summary of older exchanges, if history compaction is on.
+
+        Returns:
+            (prompt, stats) where stats reports the final prompt size and what
+            was kept
+        """
+        fixed = estimate_tokens(template.format(conversation_history="", document_context="", question=""))
+        question_tokens = estimate_tokens(question)
+        available = max(self.max_tokens - fixed - question_tokens, 0)
+
+        # Give history its share, then let context use everything history left over
+        history_budget = int(available * self.history_share)
+        full_context_tokens = sum(estimate_tokens(text) for text in dedupe_chunks(chunks))
+        if full_context_tokens < available - history_budget:
+            history_budget = available - full_context_tokens
+
+        history_text, history_kept = self._fit_history(history, history_budget, summary)
+        context_budget = available - estimate_tokens(history_text)
+        context_text, chunks_kept = self._fit_context(chunks, context_budget)
+
+        prompt = template.format(
+            conversation_history=history_text,
+            document_context=context_text,
+            question=question,
+        )
+        stats = {
+            "prompt_tokens": estimate_tokens(prompt),
+            "prompt_chars": len(prompt),
+            "history_tokens": estimate_tokens(history_text),
+            "context_tokens": estimate_tokens(context_text),
+            "question_tokens": question_tokens,
+            "history_kept": history_kept,
+            "history_dropped": len(history) - history_kept,
+            "chunks_kept": chunks_kept,
+        }
+        return prompt, stats
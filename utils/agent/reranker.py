@@ -0,0 +1,234 @@
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils.agent.llm_scheduler import scheduler
+from utils.agent.ollama_client import CHAT_URL, get_client
+from utils.agent.prompt_builder import _overlap, truncate_to_tokens
+
+
+RERANK_METHODS = (None, "mmr", "llm")
+
+LLM_RERANK_PROMPT = """Rate how useful each passage is for answering the question, from 0 (irrelevant) to 10 (answers it directly).
+Reply with only JSON of the form {{"scores": [<score of passage 1>, <score of passage 2>, ...]}} with exactly {count} numbers.
+
+Question: {question}
+
+{passages}"""
+
+
+def _unit_rows(vectors):
+    vectors = np.asarray(vectors, dtype="float32")
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def cosine_similarities(query_vec, vectors):
+    query = _unit_rows(np.reshape(query_vec, (1, -1)))[0]
+    return _unit_rows(vectors) @ query
+
+
+def mmr(query_vec, vectors, k, lambda_=0.7, relevance=None):
+    """
+    Maximal marginal relevance: repeatedly pick the candidate most similar to
+    the query, penalised by its similarity to what was already picked, so
+    near-duplicate chunks do not fill every slot.
+
+    Args:
+        query_vec: (1, dim) or (dim,) query embedding
+        vectors: (n, dim) candidate embeddings, in retrieval order
+        k: Number of candidates to select
+        lambda_: 1.0 = pure relevance, 0.0 = pure diversity
+        relevance: Relevance of each candidate in [0, 1] if not the cosine
+            similarity to the query (e.g. scaled hybrid retrieval scores)
+
+    Returns:
+        (selected positions into vectors, cosine similarity of every
+        candidate to the query)
+    """
+    if not len(vectors):
+        return [], np.zeros(0, dtype="float32")
+
+    candidates = _unit_rows(vectors)
+    similarity = cosine_similarities(query_vec, vectors)
+    relevance = similarity if relevance is None else np.asarray(relevance, dtype="float32")
+    pairwise = candidates @ candidates.T
+
+    selected = []
+    remaining = list(range(len(candidates)))
+    while remaining and len(selected) < k:
+        if selected:
+            redundancy = pairwise[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining), dtype="float32")
+        scores = lambda_ * relevance[remaining] - (1 - lambda_) * redundancy
+        best = remaining[int(np.argmax(scores))]
+        selected.append(best)
+        remaining.remove(best)
+    return selected, similarity
+
+
+def _parse_scores(text, count):
+    try:
+        scores = json.loads(text)["scores"]
+    except (ValueError, KeyError, TypeError):
+        # Models sometimes wrap the JSON in prose; take the numbers in order
+        scores = re.findall(r"-?\d+(?:\.\d+)?", text)
+    scores = [float(s) for s in scores][:count]
+    if len(scores) != count:
+        raise ValueError(f"Expected {count} scores, got {len(scores)}: {text[:200]}")
+    return scores
+
+
+def llm_scores(question, passages, model="llama3", batch_size=8, max_workers=2, passage_tokens=300):
+    """
+    Relevance of each passage to the question (0-10), scored by the chat
+    model with batch_size passages per request and up to max_workers
+    requests in flight.
+    """
+    batches = [passages[i:i + batch_size] for i in range(0, len(passages), batch_size)]
+
+    def score_batch(batch):
+        listed = "\n\n".join(
+            f"Passage {i + 1}:\n{truncate_to_tokens(text, passage_tokens)}"
+            for i, text in enumerate(batch)
+        )
+        with scheduler.slot("chat"):
+            r = get_client().post(
+                CHAT_URL,
+                {
+                    "model": model,
+                    "stream": False,
+                    "format": "json",
+                    "options": {"temperature": 0},
+                    "messages": [{
+                        "role": "user",
+                        "content": LLM_RERANK_PROMPT.format(
+                            count=len(batch), question=question, passages=listed
+                        ),
+                    }],
+                },
+            )
+        return _parse_scores(r.json()["message"]["content"], len(batch))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return [score for scores in pool.map(score_batch, batches) for score in scores]
+
+
+def merge_adjacent(results):
+    """
+    Merge results that are consecutive chunks of the same document into one
+    result (text in document order, overlap removed, "ids" lists the parts).
+    The merged result takes the rank of its best-ranked part.
+    """
+    ranked = sorted(enumerate(results), key=lambda pair: (pair[1]["source"], pair[1]["id"]))
+
+    runs = []
+    for rank, item in ranked:
+        run = runs[-1] if runs else None
+        if run and run["source"] == item["source"] and run["ids"][-1] + 1 == item["id"]:
+            run["chunk"] += item["chunk"][_overlap(run["chunk"], item["chunk"]):]
+            run["ids"].append(item["id"])
+            if rank < run["rank"]:
+                run.update({k: v for k, v in item.items() if k not in ("chunk", "id")}, rank=rank)
+        else:
+            runs.append(dict(item, ids=[item["id"]], rank=rank))
+
+    runs.sort(key=lambda run: run.pop("rank"))
+    return runs
+
+
+class Reranker:
+    def __init__(
+        self,
+        method="mmr",
+        fetch_k=20,
+        mmr_lambda=0.7,
+        min_similarity=None,
+        min_llm_score=None,
+        llm_model="llama3",
+        llm_batch_size=8,
+        merge=True,
+    ):
+        """
+        Second retrieval stage: RAG over-fetches fetch_k candidates, this
+        picks the k to send to the model.
+
+        Args:
+            method: "mmr" (diversity over the candidate embeddings), "llm"
+                (the chat model scores each candidate, batched) or None
+                (keep retrieval order)
+            fetch_k: Candidates retrieved before reranking
+            mmr_lambda: Relevance/diversity trade-off for MMR
+            min_similarity: Drop candidates whose cosine similarity to the
+                query is below this
+            min_llm_score: With method="llm", drop candidates scored below
+                this (0-10)
+            llm_model: Ollama model used for method="llm"
+            llm_batch_size: Candidates scored per LLM request
+            merge: Merge selected chunks that are adjacent in a document
+        """
+        if method not in RERANK_METHODS:
+            raise ValueError(f"Unknown rerank method '{method}', expected one of {RERANK_METHODS}")
+        self.method = method
+        self.fetch_k = fetch_k
+        self.mmr_lambda = mmr_lambda
+        self.min_similarity = min_similarity
+        self.min_llm_score = min_llm_score
+        self.llm_model = llm_model
+        self.llm_batch_size = llm_batch_size
+        self.merge = merge
+
+    def rerank(self, query, query_vec, candidates, vectors, k, relevance=None):
+        """
+        Args:
+            query: Question text
+            query_vec: (1, dim) query embedding
+            candidates: Retrieved chunks ({"id", "chunk", "source", ...}),
+                best first
+            vectors: (len(candidates), dim) their stored embeddings
+            k: Number of chunks to keep
+            relevance: Optional [0, 1] relevance per candidate for MMR,
+                instead of cosine similarity (so hybrid retrieval's lexical
+                matches are not judged by their embedding alone)
+
+        Returns:
+            At most k chunks, best first, each with "similarity" (and
+            "llm_score" for method="llm") added
+        """
+        if not candidates:
+            return []
+
+        if self.method == "mmr":
+            order, similarity = mmr(
+                query_vec, vectors, len(candidates), self.mmr_lambda, relevance=relevance
+            )
+        else:
+            order = list(range(len(candidates)))
+            similarity = cosine_similarities(query_vec, vectors)
+
+        results = []
+        for i in order:
+            if self.min_similarity is not None and similarity[i] < self.min_similarity:
+                continue
+            results.append(dict(candidates[i], similarity=float(similarity[i])))
+
+        if self.method == "llm" and results:
+            try:
+                scores = llm_scores(
+                    query, [r["chunk"] for r in results],
+                    model=self.llm_model, batch_size=self.llm_batch_size,
+                )
+                for item, score in zip(results, scores):
+                    item["llm_score"] = score
+                results.sort(key=lambda item: item["llm_score"], reverse=True)
+                if self.min_llm_score is not None:
+                    results = [r for r in results if r["llm_score"] >= self.min_llm_score]
+            except Exception as e:
+                # Reranking is an improvement, not a requirement: keep retrieval order
+                print(f"LLM rerank failed, keeping retrieval order: {e}")
+
+        results = results[:k]
+        return merge_adjacent(results) if self.merge else results
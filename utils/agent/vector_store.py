@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+
+
+# int64 dimension, then one float32 row per chunk id (row i = chunk id i)
+HEADER_BYTES = 8
+
+
+class VectorStore:
+    """
+    Full-precision embeddings kept on disk next to a compressed FAISS index
+    and read through a memory map, so exact re-scoring of a handful of
+    candidates per query touches a few pages instead of keeping every
+    float32 vector in RAM.
+
+    Rows are addressed by chunk id. Chunk ids are handed out in increasing
+    order and never reused, so rows of deleted chunks are simply left in
+    place.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dim = None
+        self._rows = None
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                self.dim = int(np.frombuffer(f.read(HEADER_BYTES), dtype="<i8")[0])
+
+    def __len__(self):
+        """Number of rows (highest stored id + 1)"""
+        if self.dim is None:
+            return 0
+        return (os.path.getsize(self.path) - HEADER_BYTES) // (self.dim * 4)
+
+    def covers(self, ids) -> bool:
+        """Whether every id in ids has a stored vector"""
+        return len(ids) == 0 or int(np.max(ids)) < len(self)
+
+    def put(self, ids, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        ids = np.asarray(ids, dtype="int64")
+        if self.dim is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.dim = vectors.shape[1]
+            with open(self.path, "wb") as f:
+                f.write(np.array([self.dim], dtype="<i8").tobytes())
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Vectors have dimension {vectors.shape[1]}, store has {self.dim}")
+
+        row_bytes = self.dim * 4
+        with open(self.path, "r+b") as f:
+            # Windows of new chunks have consecutive ids: one write per run
+            start = 0
+            for end in range(1, len(ids) + 1):
+                if end == len(ids) or ids[end] != ids[end - 1] + 1:
+                    f.seek(HEADER_BYTES + int(ids[start]) * row_bytes)
+                    f.write(vectors[start:end].tobytes())
+                    start = end
+        self._rows = None
+
+    def get(self, ids):
+        """(len(ids), dim) float32 vectors"""
+        if self._rows is None or len(self._rows) != len(self):
+            self._rows = np.memmap(
+                self.path, dtype="<f4", mode="r", offset=HEADER_BYTES, shape=(len(self), self.dim)
+            )
+        return np.array(self._rows[np.asarray(ids, dtype="int64")], dtype="float32")
+
+    def clear(self):
+        self._rows = None
+        self.dim = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -6,4 +6,38 @@ def parse_arguments() -> Namespace:
     parser.add_argument('--port', type=int, default=25565)
     parser.add_argument('--model', type=str, default='llama3')
     parser.add_argument('--email', nargs='?', type=str, default=None)
+    parser.add_argument('--stream', action='store_true', help='stream LLM generation')
+    parser.add_argument('--max-tokens', type=int, default=None, help='stop generation after this many tokens')
+    parser.add_argument('--max-latency', type=float, default=None, help='stop generation after this many seconds')
+    parser.add_argument('--prompt-tokens', type=int, default=2048, help='token budget for the assembled prompt')
+    parser.add_argument('--early-reply', action='store_true', help='push the first paragraph while generating (needs --stream)')
+    parser.add_argument('--index-mode', choices=['lazy', 'readonly', 'build'], default='lazy',
+                        help='lazy: load prebuilt index, build in background if unusable; '
+                             'readonly: refuse to start without a matching prebuilt index; '
+                             'build: build the index before serving')
+    parser.add_argument('--index-dir', type=str, default='rag', help='index artifacts directory (see build_index.py)')
+    parser.add_argument('--folder', type=str, default='documents', help='document folder')
+    parser.add_argument('--embed-model', type=str, default='mxbai-embed-large')
+    parser.add_argument('--chunker', choices=['markdown', 'fixed'], default='markdown')
+    parser.add_argument('--chunk-tokens', type=int, default=480)
+    parser.add_argument('--compression', choices=['none', 'fp16', 'sq8', 'pq'], default='none',
+                        help='store index vectors quantized to save memory')
+    parser.add_argument('--index-type', choices=['auto', 'flat', 'hnsw', 'ivfpq'], default='auto',
+                        help='FAISS index type, the same as given to build_index.py build')
+    parser.add_argument('--rescore', type=int, default=4,
+                        help='with --compression, re-rank this many times k candidates by exact distance (0 = off)')
+    parser.add_argument('--rerank', choices=['none', 'mmr', 'llm'], default='mmr',
+                        help='rerank over-fetched chunks with MMR diversity or LLM relevance scores')
+    parser.add_argument('--rerank-fetch-k', type=int, default=20, help='candidates retrieved before reranking')
+    parser.add_argument('--min-similarity', type=float, default=None,
+                        help='drop retrieved chunks below this cosine similarity to the question')
+    parser.add_argument('--debounce', type=float, default=1.5,
+                        help='answer messages sent within this many seconds of each other as one question (0 = off)')
+    parser.add_argument('--debounce-max-wait', type=float, default=6.0,
+                        help='longest a message waits for follow-up messages')
+    parser.add_argument('--llm-concurrency', type=int, default=2, help='Ollama requests allowed at the same time')
+    parser.add_argument('--llm-queue', type=int, default=16,
+                        help='questions allowed to wait for the model before replying "busy"')
+    parser.add_argument('--llm-deadline', type=float, default=30.0,
+                        help='seconds a question may wait for the model before it is dropped')
     return parser.parse_args()
\ No newline at end of file
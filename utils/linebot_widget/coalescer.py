@@ -0,0 +1,147 @@
+import logging
+import queue
+import threading
+import time
+
+from linebot.v3.webhooks import MessageEvent, TextMessageContent
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Burst:
+    """Consecutive text messages of one user, answered as one question"""
+
+    def __init__(self, user_id, events):
+        self.user_id = user_id
+        self.events = list(events)
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._committed = False
+
+    @property
+    def question(self):
+        return "\n".join(event.message.text.strip() for event in self.events)
+
+    @property
+    def event(self):
+        """Newest event, whose reply token is the freshest"""
+        return self.events[-1]
+
+    def commit(self) -> bool:
+        """Claim the burst for answering; False if it was superseded first"""
+        with self._lock:
+            if self.cancelled.is_set():
+                return False
+            self._committed = True
+            return True
+
+    def cancel(self) -> bool:
+        """Stop work on the burst; False if its answer was already committed"""
+        with self._lock:
+            if self._committed:
+                return False
+            self.cancelled.set()
+            return True
+
+
+class MessageCoalescer:
+    def __init__(self, submit, window=1.5, max_wait=6.0):
+        """
+        Debounces each user's text messages: a burst is handed to submit()
+        once the user has been quiet for window seconds (or max_wait
+        seconds after its first message), so three quick messages get one
+        retrieval, one generation and one reply.
+
+        A message that arrives while the previous burst is still queued or
+        generating supersedes it: that burst is cancelled (it is skipped,
+        or its streaming generation stopped) and its messages are answered
+        together with the new ones instead.
+
+        Args:
+            submit: Called as submit(burst) from a timer thread, typically
+                queueing the burst on the user's worker. add() must be called
+                as messages arrive (see AsyncWebhookHandler), not from that
+                worker, or a busy worker would hide the newer messages
+            window: Quiet time that ends a burst, in seconds
+            max_wait: Longest a message waits for more to arrive
+        """
+        self.submit = submit
+        self.window = window
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        self._pending = {}  # user_id -> {"events", "first", "seq", "timer"}
+        self._running = {}  # user_id -> Burst submitted but not finished yet
+
+        self.coalesced = 0
+        self.superseded = 0
+
+    @staticmethod
+    def accepts(event) -> bool:
+        """Text messages, except commands ("!clear" etc.), which run at once"""
+        return (
+            isinstance(event, MessageEvent)
+            and isinstance(event.message, TextMessageContent)
+            and not event.message.text.strip().startswith("!")
+        )
+
+    def add(self, user_id, event):
+        # Same counter main.handle_message uses for messages answered directly
+        metrics.inc("messages_total")
+        with self._lock:
+            pending = self._pending.get(user_id)
+            if pending is None:
+                pending = self._pending[user_id] = {
+                    "events": [], "first": time.time(), "seq": 0, "timer": None,
+                }
+                # The previous question is not answered yet: answer both at once
+                running = self._running.pop(user_id, None)
+                if running is not None and running.cancel():
+                    pending["events"].extend(running.events)
+                    self.superseded += 1
+                    metrics.inc("superseded_bursts_total")
+
+            pending["events"].append(event)
+            pending["seq"] += 1
+            if pending["timer"] is not None:
+                pending["timer"].cancel()
+
+            delay = min(self.window, pending["first"] + self.max_wait - time.time())
+            pending["timer"] = threading.Timer(max(delay, 0.0), self._flush, args=(user_id, pending["seq"]))
+            pending["timer"].daemon = True
+            pending["timer"].start()
+
+    def _flush(self, user_id, seq):
+        with self._lock:
+            pending = self._pending.get(user_id)
+            # A newer message restarted the timer after this one fired
+            if pending is None or pending["seq"] != seq:
+                return
+            del self._pending[user_id]
+            burst = Burst(user_id, pending["events"])
+            self._running[user_id] = burst
+
+        if len(burst.events) > 1:
+            self.coalesced += len(burst.events) - 1
+            metrics.inc("coalesced_messages_total", len(burst.events) - 1)
+
+        try:
+            self.submit(burst)
+        except queue.Full:
+            logger.warning(f"Job queue full, dropping {len(burst.events)} message(s) from {user_id}")
+            with self._lock:
+                if self._running.get(user_id) is burst:
+                    del self._running[user_id]
+
+    def finish(self, burst):
+        """Call once a submitted burst was answered (or failed), to forget it"""
+        with self._lock:
+            if self._running.get(burst.user_id) is burst:
+                del self._running[burst.user_id]
+
+    def pending(self) -> int:
+        """Users with messages waiting for their burst to end"""
+        with self._lock:
+            return len(self._pending)
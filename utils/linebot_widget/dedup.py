@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class SeenEventStore:
+    def __init__(self, ttl=3600, max_entries=10000, db_path=None):
+        """
+        Remember recently handled webhookEventIds so LINE redeliveries can be
+        dropped before any work is done
+
+        Args:
+            ttl: Seconds an event ID is remembered
+            max_entries: Maximum IDs kept in memory (oldest evicted first)
+            db_path: Optional SQLite file, shared by several processes
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.duplicates = 0
+
+        self._db = None
+        if db_path:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS seen_events (event_id TEXT PRIMARY KEY, seen_at REAL)"
+            )
+            self._db.commit()
+
+    def check_and_mark(self, event_id) -> bool:
+        """
+        Mark event_id as seen
+
+        Returns:
+            True if it was already seen within ttl (i.e. a duplicate)
+        """
+        if not event_id:
+            return False
+
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+
+            if event_id in self._seen:
+                self.duplicates += 1
+                return True
+
+            if self._db is not None and self._db_check_and_mark(event_id, now):
+                self.duplicates += 1
+                return True
+
+            self._seen[event_id] = now
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            return False
+
+    def forget(self, event_id) -> None:
+        """Unmark an event that was accepted but could not be processed"""
+        if not event_id:
+            return
+        with self._lock:
+            self._seen.pop(event_id, None)
+            if self._db is not None:
+                with self._db:
+                    self._db.execute("DELETE FROM seen_events WHERE event_id = ?", (event_id,))
+
+    def _expire(self, now):
+        while self._seen:
+            event_id, seen_at = next(iter(self._seen.items()))
+            if now - seen_at <= self.ttl:
+                break
+            self._seen.popitem(last=False)
+
+    def _db_check_and_mark(self, event_id, now) -> bool:
+        with self._db:
+            self._db.execute("DELETE FROM seen_events WHERE seen_at < ?", (now - self.ttl,))
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO seen_events (event_id, seen_at) VALUES (?, ?)",
+                (event_id, now),
+            )
+        # Nothing inserted means another worker/process already recorded it
+        return cursor.rowcount == 0
@@ -0,0 +1,126 @@
+import logging
+import queue
+import threading
+import zlib
+
+from linebot.v3 import WebhookHandler
+from linebot.v3.webhooks import MessageEvent
+
+logger = logging.getLogger(__name__)
+
+
+class UserOrderedJobQueue:
+    def __init__(self, num_workers=4, max_queue_size=1000):
+        """
+        Worker pool where every job of a user runs on the same worker thread,
+        so one user's messages are always processed in the order received
+        while different users are processed in parallel.
+
+        Args:
+            num_workers: Number of worker threads
+            max_queue_size: Maximum pending jobs per worker
+        """
+        self._queues = [queue.Queue(maxsize=max_queue_size) for _ in range(num_workers)]
+        self._workers = []
+        for i, q in enumerate(self._queues):
+            worker = threading.Thread(
+                target=self._run, args=(q,), name=f"webhook-worker-{i}", daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, user_id, fn, *args):
+        """
+        Queue fn(*args) on the user's worker
+
+        Raises:
+            queue.Full if that worker's backlog is full
+        """
+        key = zlib.crc32((user_id or "").encode("utf-8"))
+        self._queues[key % len(self._queues)].put_nowait((fn, args))
+
+    def pending(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def shutdown(self, wait=True):
+        for q in self._queues:
+            q.put((None, None))
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    @staticmethod
+    def _run(q):
+        while True:
+            fn, args = q.get()
+            if fn is None:
+                break
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception("Webhook job failed")
+            finally:
+                q.task_done()
+
+
+class AsyncWebhookHandler(WebhookHandler):
+    def __init__(self, channel_secret, job_queue, seen_events=None, coalescer=None):
+        """
+        WebhookHandler that only verifies the signature and parses events in
+        the request; the registered handler functions run on job_queue.
+
+        Args:
+            channel_secret: LINE channel secret
+            job_queue: UserOrderedJobQueue running the handlers
+            seen_events: Optional SeenEventStore; events whose webhookEventId
+                was already handled (LINE redeliveries) are dropped
+            coalescer: Optional MessageCoalescer; the events it accepts are
+                handed to it on arrival instead of being queued, so it sees
+                a user's new message even while their worker is busy
+        """
+        super().__init__(channel_secret)
+        self.job_queue = job_queue
+        self.seen_events = seen_events
+        self.coalescer = coalescer
+
+    def handle(self, body, signature):
+        payload = self.parser.parse(body, signature, as_payload=True)
+
+        for event in payload.events:
+            if self.seen_events is not None and self.seen_events.check_and_mark(
+                getattr(event, "webhook_event_id", None)
+            ):
+                redelivery = getattr(event.delivery_context, "is_redelivery", False)
+                logger.info(
+                    f"Dropping duplicate event {event.webhook_event_id} (redelivery={redelivery})"
+                )
+                continue
+
+            user_id = getattr(event.source, "user_id", None)
+            if self.coalescer is not None and self.coalescer.accepts(event):
+                self.coalescer.add(user_id, event)
+                continue
+            try:
+                self.job_queue.submit(user_id, self.dispatch, event, payload.destination)
+            except queue.Full:
+                # Not handled, so let LINE's redelivery of this event through
+                if self.seen_events is not None:
+                    self.seen_events.forget(getattr(event, "webhook_event_id", None))
+                raise
+
+    def dispatch(self, event, destination=None):
+        """Run the handler registered for event, same lookup as WebhookHandler.handle"""
+        func = None
+        if isinstance(event, MessageEvent):
+            func = self._handlers.get(
+                f"{event.__class__.__name__}_{event.message.__class__.__name__}"
+            )
+        if func is None:
+            func = self._handlers.get(event.__class__.__name__)
+        if func is None:
+            func = self._default
+
+        if func is None:
+            logger.info(f"No handler for {event.__class__.__name__} and no default handler")
+        else:
+            func(event)
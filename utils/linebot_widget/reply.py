@@ -0,0 +1,64 @@
+import logging
+import time
+
+from linebot.v3.messaging import (
+    ApiClient,
+    ApiException,
+    MessagingApi,
+    PushMessageRequest,
+    ReplyMessageRequest,
+    TextMessage,
+)
+
+from utils.metrics import metrics, stage
+
+logger = logging.getLogger(__name__)
+
+# LINE reply tokens expire shortly after the webhook is sent; keep a margin
+REPLY_TOKEN_TTL = 50
+
+
+def reply_token_expired(event, ttl=REPLY_TOKEN_TTL) -> bool:
+    """event.timestamp is the webhook event time in milliseconds"""
+    return time.time() - event.timestamp / 1000 > ttl
+
+
+def send_text(configuration, event, text):
+    """
+    Answer an event with a reply message, or with a push message to the
+    user once the reply token has expired (or the reply is rejected).
+    """
+    messages = [TextMessage(text=text)]
+
+    with ApiClient(configuration) as api_client:
+        line_bot_api = MessagingApi(api_client)
+
+        if event.reply_token and not reply_token_expired(event):
+            try:
+                with stage("line_reply"):
+                    line_bot_api.reply_message_with_http_info(
+                        ReplyMessageRequest(reply_token=event.reply_token, messages=messages)
+                    )
+                metrics.inc("line_messages_total", kind="reply")
+                return
+            except ApiException as e:
+                logger.info(f"Reply failed ({e.status}), falling back to push message")
+
+        user_id = getattr(event.source, "user_id", None)
+        if user_id is None:
+            logger.warning("Reply token expired and event has no user_id to push to")
+            return
+
+        with stage("line_push"):
+            line_bot_api.push_message_with_http_info(
+                PushMessageRequest(to=user_id, messages=messages)
+            )
+        metrics.inc("line_messages_total", kind="push")
+
+
+def push_text(configuration, user_id, text):
+    with ApiClient(configuration) as api_client, stage("line_push"):
+        MessagingApi(api_client).push_message_with_http_info(
+            PushMessageRequest(to=user_id, messages=[TextMessage(text=text)])
+        )
+    metrics.inc("line_messages_total", kind="push")
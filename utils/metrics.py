@@ -0,0 +1,176 @@
+"""
+Lightweight in-process metrics: counters, latency histograms and gauges,
+rendered in the Prometheus text format by the /metrics route, plus per-request
+traces that are logged as one JSON line when the request finishes.
+
+    with stage("vector_search"):
+        ...
+
+records the duration in the stage_seconds histogram and, if a trace is
+active on this thread, in that trace.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}    # name -> {label key: value}
+        self._histograms = {}  # name -> {label key: [bucket counts..., sum, count]}
+        self._gauges = {}      # name -> callable returning {label key: value} or a number
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _label_key(labels)
+            data = series.get(key)
+            if data is None:
+                data = series[key] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def gauge(self, name, fn, help_text=None):
+        """Register fn() -> number or {labels dict as tuple: number}, read at scrape time"""
+        self._gauges[name] = fn
+        if help_text:
+            self.describe(name, help_text)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+
+        def header(name, kind):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                header(name, "counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+
+            for name, series in sorted(self._histograms.items()):
+                header(name, "histogram")
+                for key, data in series.items():
+                    for bound, count in zip(LATENCY_BUCKETS, data):
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {data[-1]}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {data[-2]}")
+                    lines.append(f"{name}_count{_format_labels(key)} {data[-1]}")
+
+        for name, fn in sorted(self._gauges.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            header(name, "gauge")
+            if isinstance(value, dict):
+                for labels, v in value.items():
+                    lines.append(f"{name}{_format_labels(labels)} {v}")
+            else:
+                lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("stage_seconds", "Time spent in each stage of handling a message")
+metrics.describe("stage_errors_total", "Stages that raised an exception")
+
+_local = threading.local()
+
+
+class Trace:
+    """Timings and attributes of one request, logged as a single JSON line"""
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = dict(attrs)
+        self.stages = {}
+        self.start = time.time()
+
+    def add_stage(self, stage_name, seconds):
+        # A stage can run more than once per request (e.g. two LINE API calls)
+        self.stages[stage_name] = round(self.stages.get(stage_name, 0.0) + seconds, 4)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self):
+        record = {
+            "trace": self.name,
+            "total_seconds": round(time.time() - self.start, 4),
+            "stages": self.stages,
+            **self.attrs,
+        }
+        # One JSON object per line, easy to grep or ship to a log pipeline
+        print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+        return record
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def trace(name, **attrs):
+    """Make a Trace current on this thread for the duration of the block"""
+    t = Trace(name, **attrs)
+    previous = current_trace()
+    _local.trace = t
+    try:
+        yield t
+    except Exception as e:
+        t.set(error=repr(e))
+        raise
+    finally:
+        _local.trace = previous
+        t.finish()
+
+
+@contextmanager
+def stage(name):
+    """Time a block into stage_seconds{stage=name} and the current trace"""
+    start = time.time()
+    try:
+        yield
+    except Exception:
+        metrics.inc("stage_errors_total", stage=name)
+        raise
+    finally:
+        seconds = time.time() - start
+        metrics.observe("stage_seconds", seconds, stage=name)
+        t = current_trace()
+        if t is not None:
+            t.add_stage(name, seconds)
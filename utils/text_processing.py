@@ -1,31 +1,55 @@
 import glob
+import hashlib
+import re
+import time
 import numpy as np
-import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import markdown
 from bs4 import BeautifulSoup
 from pathlib import Path
 
+from utils.agent.llm_scheduler import scheduler
+from utils.agent.ollama_client import EMBED_BATCH_URL, get_client
+from utils.agent.prompt_builder import estimate_tokens, truncate_to_tokens
 
-def load_text_files(folder="documents"):
+
+def list_document_files(folder="documents"):
     txt_files = glob.glob(f"{folder}/*.txt")
     md_files = glob.glob(f"{folder}/*.md")
 
-    all_files =  txt_files + md_files
+    return sorted(txt_files + md_files)
+
+
+def load_text_file(path):
+    file_ext = Path(path).suffix.lower()
 
-    docs = []
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
 
-    for path in all_files:
-        file_ext = Path(path).suffix.lower()
+    if file_ext == ".md":
+        content = markdown_to_text(content)
 
-        with open(path, "r", encoding="utf-8") as f:
-            content = f.read()
+    return content
 
-        if file_ext == ".md":
-            content = markdown_to_text(content)
-        
-        docs.append((path, content))
-    return docs
+
+def file_content_hash(path):
+    """SHA-256 of the raw file bytes, used to detect edited documents"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def iter_text_files(folder="documents"):
+    """Yield (path, text) one document at a time"""
+    for path in list_document_files(folder):
+        yield path, load_text_file(path)
+
+
+def load_text_files(folder="documents"):
+    return list(iter_text_files(folder))
 
 
 # RAG needs chunks
@@ -42,31 +66,280 @@ def chunk_text(text, chunk_size=1500, overlap=200):
     return chunks
 
 
-def get_chunks(folder="documents"):
-    docs = load_text_files(folder)
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+# Split after Chinese/full-width sentence punctuation, or after English
+# punctuation followed by whitespace. The split is zero-width: whitespace
+# stays at the start of the next sentence, so joining sentences with ""
+# gives back the original text
+_SENTENCE_RE = re.compile(r"(?<=[。！？；!?])|(?<=[.;:])(?=\s)")
+
+
+def split_markdown_sections(markdown_content):
+    """
+    Split a markdown document at its headings.
+
+    Returns:
+        List of (heading_path, body) where heading_path is the list of
+        enclosing heading titles, outermost first, and body is the section
+        text converted to plain text
+    """
+    sections = []
+    path = []
+    lines = []
+    in_fence = False
+
+    def flush():
+        body = markdown_to_text("\n".join(lines)) if any(l.strip() for l in lines) else ""
+        if body or path:
+            sections.append((list(path), body))
+
+    for line in markdown_content.splitlines():
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+        match = None if in_fence else _HEADING_RE.match(line)
+        if not match:
+            lines.append(line)
+            continue
+
+        flush()
+        level = len(match.group(1))
+        del path[level - 1:]
+        # Skipped levels (## directly followed by ####) are simply left out
+        path.append(match.group(2))
+        lines = []
+    flush()
+
+    # Headings with no text of their own still show up in their children's path
+    return [(p, body) for p, body in sections if body]
+
+
+def split_sentences(text):
+    return [s for s in _SENTENCE_RE.split(text) if s.strip()]
+
+
+def _split_to_fit(text, max_tokens):
+    """Paragraph -> sentences -> hard cuts, until every piece fits max_tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    pieces = []
+    for sentence in split_sentences(text):
+        while estimate_tokens(sentence) > max_tokens:
+            head = truncate_to_tokens(sentence, max_tokens)
+            pieces.append(head)
+            sentence = sentence[len(head):]
+        if sentence.strip():
+            pieces.append(sentence)
+    return [p.strip() for p in _pack(pieces, max_tokens, "")]
+
+
+def _pack(pieces, max_tokens, separator):
+    """Greedily join consecutive pieces into strings of at most max_tokens"""
+    packed = []
+    current = ""
+    for piece in pieces:
+        candidate = current + separator + piece if current else piece
+        if current and estimate_tokens(candidate) > max_tokens:
+            packed.append(current)
+            current = piece
+        else:
+            current = candidate
+    if current:
+        packed.append(current)
+    return packed
+
+
+def _render_group(group):
+    if len(group["sections"]) == 1:
+        title, body = group["sections"][0]
+        heading = " > ".join(group["parent"] + ([title] if title else []))
+        return heading + "\n" + body if heading else body
+
+    parts = [" > ".join(group["parent"])] if group["parent"] else []
+    parts.extend(title + "\n" + body for title, body in group["sections"])
+    return "\n\n".join(parts)
+
+
+def chunk_sections(sections, max_tokens=400):
+    """
+    Turn (heading_path, body) sections into chunks of at most max_tokens
+    (estimated) without cutting through paragraphs or sentences unless they
+    are longer than a whole chunk. There is no overlap between chunks.
 
+    Each chunk starts with its heading path, and consecutive sections that
+    fit whole and share a parent heading are packed into one chunk.
+
+    Returns:
+        List of {"text", "meta"} where meta["heading_path"] is the heading
+        path of the chunk and meta["sections"] the titles of the sections
+        packed into it
+    """
+    groups = []
+    for path, body in sections:
+        parent, title = path[:-1], (path[-1] if path else "")
+        budget = max(max_tokens - estimate_tokens(" > ".join(path)) - 1, 1)
+
+        paragraphs = []
+        for paragraph in body.split("\n"):
+            if paragraph.strip():
+                paragraphs.extend(_split_to_fit(paragraph.strip(), budget))
+        pieces = _pack(paragraphs, budget, "\n")
+
+        if len(pieces) == 1 and title and groups:
+            previous = groups[-1]
+            merged = {
+                "parent": parent,
+                "sections": previous["sections"] + [(title, pieces[0])],
+                "mergeable": True,
+            }
+            if (
+                previous["mergeable"]
+                and previous["parent"] == parent
+                and estimate_tokens(_render_group(merged)) <= max_tokens
+            ):
+                groups[-1] = merged
+                continue
+
+        for piece in pieces:
+            groups.append({
+                "parent": parent,
+                "sections": [(title, piece)],
+                "mergeable": len(pieces) == 1 and bool(title),
+            })
+
+    chunks = []
+    for group in groups:
+        titles = [title for title, _ in group["sections"] if title]
+        chunks.append({
+            "text": _render_group(group),
+            "meta": {
+                "heading_path": group["parent"] + titles if len(titles) == 1 else group["parent"],
+                "sections": titles,
+            },
+        })
+    return chunks
+
+
+def chunk_document(path, max_tokens=400):
+    """
+    Structure-aware chunks for one document: markdown is split on its
+    headings, plain text is treated as a single section.
+
+    Returns:
+        List of {"text", "meta"} (see chunk_sections)
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+
+    if Path(path).suffix.lower() == ".md":
+        sections = split_markdown_sections(content)
+    else:
+        sections = [([], content)]
+    return chunk_sections(sections, max_tokens)
+
+
+def iter_chunks(folder="documents"):
+    """Yield (path, chunk) without holding more than one document in memory"""
+    for path, text in iter_text_files(folder):
+        for chunk in chunk_text(text):
+            yield path, chunk
+
+
+def get_chunks(folder="documents"):
     all_chunks = []
     chunk_sources = []
 
-    for path, text in docs:
-        chunks = chunk_text(text)
-        all_chunks.extend(chunks)
-        chunk_sources.extend([path] * len(chunks))
+    for path, chunk in iter_chunks(folder):
+        all_chunks.append(chunk)
+        chunk_sources.append(path)
 
     return all_chunks, chunk_sources
 
 
 def embed_ollama(texts, model="mxbai-embed-large"):
-    vectors = []
-    for t in texts:
-        r = requests.post(
-            "http://localhost:11434/api/embeddings",
-            json={"model": model, "prompt": t}
+    """
+    Embed a whole batch of texts with a single request to Ollama's
+    multi-input /api/embed endpoint, over the shared keep-alive client.
+    """
+    r = get_client().post(
+        EMBED_BATCH_URL,
+        {"model": model, "input": list(texts)},
+    )
+    r.raise_for_status()
+
+    vectors = r.json()["embeddings"]
+    if len(vectors) != len(texts):
+        raise ValueError(
+            f"Ollama returned {len(vectors)} embeddings for {len(texts)} inputs"
         )
-        vectors.append(r.json()["embedding"])
     return np.array(vectors, dtype="float32")
 
 
+def _embed_with_retry(texts, model, retries, backoff):
+    for attempt in range(retries + 1):
+        try:
+            # Index builds only get model slots that chat is not waiting for
+            with scheduler.slot("index"):
+                return embed_ollama(texts, model)
+        except Exception as e:
+            if attempt == retries:
+                raise RuntimeError(
+                    f"Embedding batch failed after {retries + 1} attempts: {e}"
+                )
+            time.sleep(backoff * (2 ** attempt))
+
+
+def embed_batches_concurrent(
+    texts,
+    batch_size=32,
+    max_workers=4,
+    model="mxbai-embed-large",
+    retries=3,
+    backoff=0.5,
+    progress=True,
+):
+    """
+    Embed texts in batches, keeping up to max_workers batch requests in
+    flight at once. Failed batches are retried with exponential backoff.
+
+    Args:
+        texts: List of strings to embed
+        batch_size: Number of texts sent per /api/embed request
+        max_workers: Maximum number of concurrent requests
+        model: Ollama embedding model
+        retries: Extra attempts per batch before giving up
+        backoff: Base delay (seconds) between retries
+        progress: Print progress as batches complete
+
+    Returns:
+        float32 array of shape (len(texts), dim), in input order
+    """
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    if not batches:
+        return np.zeros((0, 0), dtype="float32")
+
+    results = [None] * len(batches)
+    done = 0
+    start = time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(_embed_with_retry, batch, model, retries, backoff): i
+            for i, batch in enumerate(batches)
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            done += 1
+            if progress:
+                print(
+                    f"Embedded batch {done}/{len(batches)} "
+                    f"({time.time() - start:.1f}s elapsed)"
+                )
+
+    return np.vstack(results)
+
+
 """
 # Deprecated for now, kept in case we switch to OpenAI in the future
 # client should be the OpenAI client
@@ -102,4 +375,14 @@ def markdown_to_text(markdown_content):
     lines = [line.strip() for line in text.split('\n')]
     text = '\n'.join(line for line in lines if line)
     
-    return text
\ No newline at end of file
+    return text
+
+
+if __name__ == "__main__":
+    # Over-long paragraphs are split at sentences without gluing them together
+    paragraph = ("This is the first sentence of a long paragraph. " * 40).strip()
+    pieces = _split_to_fit(paragraph, 60)
+    assert all(estimate_tokens(p) <= 60 for p in pieces), pieces
+    assert " ".join(pieces) == paragraph, pieces
+    assert "".join(_split_to_fit("第一句。第二句！" * 200, 60)) == "第一句。第二句！" * 200
+    print(f"{len(pieces)} pieces, e.g. {pieces[0]!r}")